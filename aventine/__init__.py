@@ -34,7 +34,10 @@ def create_app(test_config=None):
     from . import search
     app.register_blueprint(search.bp)
 
-    # from . import api
-    # app.register_blueprint(api.bp)
+    from . import api
+    app.register_blueprint(api.bp)
+
+    from . import monitor
+    app.register_blueprint(monitor.bp)
 
     return app
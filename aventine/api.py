@@ -1,8 +1,232 @@
+import json
+import gzip
+import warnings
+import base64
+import hashlib
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for
+    Blueprint, flash, g, redirect, render_template, request, session, url_for, Response
 )
+from aventine.library.engines import default_engine as engine
+from aventine.library.engines import default_scheduler as scheduler
+from aventine.library.params import API_PAGE_SIZE, API_MAX_RESULTS, API_MAX_BATCH
+from aventine.library.params import API_CITATIONS, API_MAX_AGE, API_GZIP_MIN_BYTES
 
 bp = Blueprint('api', __name__, url_prefix='/api')
 
 
-from aventine.library.engines import default_engine as engine
+class APIError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+@bp.errorhandler(APIError)
+def api_error(e):
+    return Response(json.dumps({'error': str(e)}), status=e.status, mimetype='application/json')
+
+
+def encode_cursor(offset):
+    data = json.dumps({'o': offset, 'v': engine.index_version[:12]}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """The offset a cursor points to; cursors from another index version are refused."""
+    if not cursor:
+        return 0
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        offset, version = int(data['o']), data['v']
+    except (ValueError, KeyError, TypeError):
+        raise APIError('Malformed cursor.')
+    if offset < 0:
+        raise APIError('Malformed cursor.')
+    if version != engine.index_version[:12]:
+        raise APIError('The index has changed since this cursor was issued; start again.', status=410)
+    return offset
+
+def int_arg(args, name, default, low, high):
+    try:
+        value = int(args.get(name, default))
+    except (TypeError, ValueError):
+        raise APIError(f'`{name}` must be an integer.')
+    if not low <= value <= high:
+        raise APIError(f'`{name}` must be between {low} and {high}.')
+    return value
+
+def scope_arg(scope):
+    if scope is None:
+        return 'universal'
+    # A text's scope is a path into the index, so only known ones are allowed
+    if not isinstance(scope, str) or scope not in {'universal', 'root'} | set(engine.all_docs):
+        raise APIError(f'Unknown scope `{scope}`.')
+    return scope
+
+def texts_arg(texts):
+    if texts is None or texts == 'ALL':
+        return None
+    if isinstance(texts, str):
+        texts = texts.split(',')
+    texts = {i.strip() for i in texts}
+    unknown = texts.difference(engine.id2title)
+    if unknown:
+        raise APIError(f'Unknown texts: {", ".join(sorted(unknown))}.')
+    return texts
+
+
+def respond(payload, cacheable=True):
+    """
+    Compact JSON, gzipped for clients that accept it once it is large enough
+    to be worth it. Cacheable responses carry an ETag derived from the index
+    version, the request and the content encoding (the gzipped and identity
+    bodies differ byte for byte), and are answered with a 304 when it matches.
+    """
+    body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    encoding = None
+    if len(body) >= API_GZIP_MIN_BYTES and 'gzip' in request.accept_encodings:
+        encoding = 'gzip'
+
+    etag = None
+    if cacheable:
+        digest = hashlib.sha1(
+            f'{engine.index_version}|{request.path}|{sorted(request.args.items(multi=True))}|{encoding}'.encode('utf-8')
+        )
+        etag = digest.hexdigest()[:32]
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.vary.add('Accept-Encoding')
+            response.set_etag(etag)
+            response.cache_control.public = True
+            response.cache_control.max_age = API_MAX_AGE
+            return response
+
+    response = Response(mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if encoding == 'gzip':
+        body = gzip.compress(body, compresslevel=5)
+        response.headers['Content-Encoding'] = 'gzip'
+    response.set_data(body)
+
+    if cacheable:
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = API_MAX_AGE
+    else:
+        response.cache_control.no_store = True
+    return response
+
+
+def compact(result, rank, citations):
+    texts = {}
+    for text_id in sorted(result['texts']):
+        shown = result['links'][text_id][:citations]
+        texts[text_id] = {
+            'count': result['counts'][text_id],
+            'citations': shown,
+            # For `/api/citations`
+            'next': encode_cursor(len(shown)) if result['counts'][text_id] > len(shown) else None
+        }
+    return {
+        'rank': rank,
+        'score': round(result['score'], 6),
+        'lemma': result['lemma'],
+        'definition': result['definition'],
+        'texts': texts
+    }
+
+def page(data, offset, limit, citations):
+    return {
+        'results': [compact(result, offset + i, citations)
+                    for i, result in enumerate(data[offset:offset + limit])],
+        'next': encode_cursor(offset + limit) if len(data) > offset + limit else None
+    }
+
+
+@bp.route('/search')
+def search():
+    args = request.args
+    query = (args.get('query') or '').strip()
+    language = (args.get('language') or '').strip()
+    if query == '' or language not in {'eng', 'lat'}:
+        raise APIError('`query` and a `language` of `eng` or `lat` are required.')
+
+    texts = texts_arg(args.get('texts'))
+    scope = scope_arg(args.get('scope'))
+    offset = decode_cursor(args.get('cursor'))
+    limit = int_arg(args, 'limit', API_PAGE_SIZE, 1, API_MAX_RESULTS)
+    citations = int_arg(args, 'citations', API_CITATIONS, 0, API_MAX_RESULTS)
+    if offset + limit > API_MAX_RESULTS:
+        raise APIError(f'Only the first {API_MAX_RESULTS} results can be paged through.')
+
+    # One more than the page, to tell whether there is a next one
+    data = scheduler.search(query=query, language=language, texts=texts,
+                            results=offset + limit + 1, scope=scope)
+    if data is None:
+        raise APIError('No results: the query has no usable words.', status=422)
+
+    return respond({
+        'query': query,
+        'language': language,
+        'texts': 'ALL' if texts is None else sorted(texts),
+        'index_version': engine.index_version,
+        **page(data, offset, limit, citations)
+    })
+
+
+@bp.route('/search/batch', methods=['POST'])
+def search_batch():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('queries'), list):
+        raise APIError('Expected a JSON object with a list of `queries`.')
+
+    queries = [str(query).strip() for query in body['queries']]
+    language = body.get('language')
+    if language not in {'eng', 'lat'}:
+        raise APIError('`language` must be `eng` or `lat`.')
+    if not 0 < len(queries) <= API_MAX_BATCH:
+        raise APIError(f'Between 1 and {API_MAX_BATCH} queries are accepted at once.')
+
+    texts = texts_arg(body.get('texts'))
+    scope = scope_arg(body.get('scope'))
+    limit = int_arg(body, 'limit', API_PAGE_SIZE, 1, API_MAX_RESULTS)
+    citations = int_arg(body, 'citations', API_CITATIONS, 0, API_MAX_RESULTS)
+
+    # As `engine.search` does for a single query, errors are answered in JSON
+    try:
+        batch = engine.search_batch(queries, language, texts=texts,
+                                    results=limit + 1, scope=scope)
+    except Exception as e:
+        warnings.warn(f'Batch of {len(queries)} queries failed: {e}')
+        raise APIError('The search failed.', status=500)
+    return respond({
+        'language': language,
+        'texts': 'ALL' if texts is None else sorted(texts),
+        'index_version': engine.index_version,
+        'batch': [
+            {'query': query, 'error': 'No usable words in the query.'} if data is None else
+            {'query': query, **page(data, 0, limit, citations)}
+            for query, data in zip(queries, batch)
+        ]
+    }, cacheable=False)
+
+
+@bp.route('/citations')
+def citations():
+    args = request.args
+    lemma = (args.get('lemma') or '').strip()
+    text_id = (args.get('text') or '').strip()
+    if text_id not in engine.id2title:
+        raise APIError(f'Unknown text `{text_id}`.')
+    if lemma not in engine.text_ckpts[text_id].corpus_lemmata_info:
+        raise APIError(f'`{lemma}` does not occur in `{text_id}`.', status=404)
+
+    offset = decode_cursor(args.get('cursor'))
+    limit = int_arg(args, 'limit', API_PAGE_SIZE, 1, API_MAX_RESULTS)
+    total = engine.num_citations(lemma, text_id)
+
+    return respond({
+        'lemma': lemma,
+        'text': text_id,
+        'total': total,
+        'citations': engine.citations(lemma, text_id, offset=offset, limit=limit),
+        'next': encode_cursor(offset + limit) if total > offset + limit else None
+    })
@@ -0,0 +1,201 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+from pathlib import Path
+
+from aventine.library import search as search_module
+from aventine.library import models as models_module
+from aventine.library.params import ROOT_FINGERPRINT, CORPUS_FINGERPRINT
+from aventine.library.utils import Checkpointer
+from aventine.library.files import linear_parse
+from aventine.benchmarks.synthetic import synthetic_index, synthetic_xml, synthetic_lemmata, stub_models
+
+
+def latency(func, repeat: int = 100, warmup: int = 3) -> dict:
+    """Distribution of the wall-clock time of `func()`, in milliseconds."""
+    for _ in range(warmup):
+        func()
+    times = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times[i] = time.perf_counter() - start
+    times *= 1000
+    return {
+        'n': repeat,
+        'mean_ms': float(times.mean()),
+        'min_ms': float(times.min()),
+        'p50_ms': float(np.percentile(times, 50)),
+        'p90_ms': float(np.percentile(times, 90)),
+        'p99_ms': float(np.percentile(times, 99)),
+        'max_ms': float(times.max())
+    }
+
+
+def _cycle(items):
+    i = -1
+    def take():
+        nonlocal i
+        i = (i + 1) % len(items)
+        return items[i]
+    return take
+
+
+def load_engine(sources_dir: Path, index_dir: Path, models: dict, snapshot: bool = True):
+    """
+    An `AventineSearch` over a synthetic index with stub models, whatever
+    `MODE` is set to. Without `snapshot`, it is loaded from the checkpoints.
+    """
+    # Engines take their models from the process-wide registry; `lat_none` is
+    # derived from `lat_model`, so it is dropped to be derived from the stub
+    models_module._loaded.update(models)
+    models_module._loaded.pop('lat_none', None)
+
+    mode, _snapshot = search_module.MODE, search_module.SNAPSHOT
+    search_module.MODE, search_module.SNAPSHOT = 'SEARCH', snapshot and _snapshot
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            engine = search_module.AventineSearch(sources_dir, index_dir, tool_dir=sources_dir, verbose=False)
+    finally:
+        search_module.MODE, search_module.SNAPSHOT = mode, _snapshot
+    return engine
+
+
+def run(
+    work_dir: Path,
+    num_lemmata: int = 20000,
+    num_texts: int = 10,
+    texts_per_lemma: int = 3,
+    locs_per_lemma: int = 20,
+    chunks_per_text: int = 5000,
+    lat_dims: int = 100,
+    eng_dims: int = 768,
+    repeat: int = 100,
+    batch_size: int = 16,
+    seed: int = 0
+) -> dict:
+    """
+    Builds a synthetic index in `work_dir` and times loading it, searching it
+    (uncached, through `_search` and `_search_batch`), saving and loading
+    its checkpoints, and parsing a synthetic XML file.
+    """
+    work_dir = Path(work_dir)
+    sources_dir, index_dir = work_dir / 'sources', work_dir / 'index'
+    rng = np.random.default_rng(seed)
+
+    start = time.perf_counter()
+    config = synthetic_index(sources_dir, index_dir,
+                             num_lemmata=num_lemmata, num_texts=num_texts,
+                             texts_per_lemma=texts_per_lemma, locs_per_lemma=locs_per_lemma,
+                             chunks_per_text=chunks_per_text,
+                             lat_dims=lat_dims, eng_dims=eng_dims, seed=seed)
+    config |= {'repeat': repeat, 'batch_size': batch_size,
+               'generate_s': time.perf_counter() - start}
+    models = stub_models(lat_dims, eng_dims)
+    results = {}
+
+    # Loading: from the checkpoints, then from the snapshot written by the warmup load
+    results['load_checkpoints'] = latency(lambda: load_engine(sources_dir, index_dir, models, snapshot=False),
+                                          repeat=max(repeat // 20, 3), warmup=1)
+    if search_module.SNAPSHOT:
+        results['load_snapshot'] = latency(lambda: load_engine(sources_dir, index_dir, models),
+                                           repeat=max(repeat // 20, 3), warmup=1)
+
+    engine = load_engine(sources_dir, index_dir, models)
+    lemmata = engine.r.lemmata_arr
+    lat_queries = [' '.join(rng.choice(lemmata, size=3)) for _ in range(repeat)]
+    eng_queries = [f'query {i} ' + ' '.join(rng.choice(lemmata, size=3)) for i in range(repeat)]
+    subsets = [set(rng.choice(engine.all_docs, size=max(num_texts // 3, 1), replace=False))
+               for _ in range(repeat)]
+
+    # Queries are never repeated, so neither the query nor the result cache helps
+    for language, queries in (('eng', eng_queries), ('lat', lat_queries)):
+        take, texts = _cycle(queries), _cycle(subsets)
+        results[f'search_{language}'] = latency(
+            lambda: engine._search(take(), language), repeat=repeat, warmup=0
+        )
+        engine.query_cache.clear()
+        results[f'search_{language}_texts'] = latency(
+            lambda: engine._search(take(), language, texts=texts()), repeat=repeat, warmup=0
+        )
+        engine.query_cache.clear()
+        batches = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+        take = _cycle(batches)
+        results[f'search_batch_{language}'] = latency(
+            lambda: engine._search_batch(take(), language), repeat=len(batches), warmup=0
+        )
+        engine.query_cache.clear()
+
+    # Checkpoints, saved to and loaded from a scratch copy
+    text_id = engine.all_docs[0]
+    for name, src, fingerprint in (('root', index_dir / 'root', ROOT_FINGERPRINT),
+                                   ('corpus', index_dir / text_id, CORPUS_FINGERPRINT)):
+        bundle = Checkpointer(src, fingerprint).load()
+        ckpt = Checkpointer(work_dir / 'scratch' / name, fingerprint)
+        results[f'checkpoint_save_{name}'] = latency(lambda: ckpt.save(bundle), repeat=max(repeat // 10, 3), warmup=1)
+        results[f'checkpoint_load_{name}'] = latency(lambda: ckpt.load(), repeat=max(repeat // 10, 3), warmup=1)
+
+    xml_fpath = work_dir / 'synthetic.xml'
+    synthetic_xml(xml_fpath, synthetic_lemmata(2000, seed), seed=seed)
+    config['xml_bytes'] = os.path.getsize(xml_fpath)
+    results['linear_parse'] = latency(lambda: linear_parse(xml_fpath), repeat=max(repeat // 10, 3), warmup=1)
+
+    return {
+        'config': config,
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()
+        },
+        'results': results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times the Aventine engine on a synthetic index.')
+    parser.add_argument('--lemmata', type=int, default=20000)
+    parser.add_argument('--texts', type=int, default=10)
+    parser.add_argument('--texts-per-lemma', type=int, default=3)
+    parser.add_argument('--locs-per-lemma', type=int, default=20)
+    parser.add_argument('--chunks-per-text', type=int, default=5000)
+    parser.add_argument('--lat-dims', type=int, default=100)
+    parser.add_argument('--eng-dims', type=int, default=768)
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', type=Path, default=None,
+                        help='where to build the index (kept); a temporary directory by default')
+    parser.add_argument('--output', type=Path, default=None,
+                        help='JSON file to write the report to, besides printing it')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or Path(tempfile.mkdtemp(prefix='aventine-bench-'))
+    try:
+        report = run(work_dir,
+                     num_lemmata=args.lemmata, num_texts=args.texts,
+                     texts_per_lemma=args.texts_per_lemma, locs_per_lemma=args.locs_per_lemma,
+                     chunks_per_text=args.chunks_per_text,
+                     lat_dims=args.lat_dims, eng_dims=args.eng_dims,
+                     repeat=args.repeat, batch_size=args.batch_size, seed=args.seed)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    out = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(out + '\n')
+    print(out)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+import os
+import json
+import hashlib
+import numpy as np
+from pathlib import Path
+
+from aventine.library.params import ROOT_FINGERPRINT, CORPUS_FINGERPRINT
+from aventine.library.params import SMALL_SEP, CHUNK_SEP
+from aventine.library.utils import Checkpointer, Bundler, LargeDict
+from aventine.library.matrices import build_root_matrices
+
+
+_consonants = 'bcdfglmnprstv'
+_vowels = 'aeiou'
+_endings = ('us', 'um', 'a', 'is', 'or', 'ex', 'o', 'es')
+
+
+def synthetic_lemmata(
+    n: int,
+    seed: int = 0
+) -> list[str]:
+    """`n` distinct, Latin-looking lowercase words."""
+    rng = np.random.default_rng(seed)
+    lemmata = set()
+    while len(lemmata) < n:
+        syllables = rng.integers(1, 4)
+        stem = ''.join(rng.choice(list(_consonants)) + rng.choice(list(_vowels))
+                       for _ in range(syllables))
+        lemmata.add(stem + rng.choice(_endings))
+    return sorted(lemmata)
+
+
+def _seeded(word: str, dims: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha1(word.encode('utf-8')).digest()[:8], 'little')
+    return np.random.default_rng(seed).standard_normal(dims).astype(np.float32)
+
+
+class StubEncoder():
+    """Stands in for the SentenceTransformer: one fixed random vector per text."""
+    def __init__(self, dims: int):
+        self.dims = dims
+
+    def encode(self, sentences):
+        if isinstance(sentences, str):
+            return _seeded(sentences, self.dims)
+        return np.stack([_seeded(s, self.dims) for s in sentences])
+
+
+class StubWordVectors():
+    """Stands in for the Latin word embeddings: one fixed random vector per word."""
+    def __init__(self, dims: int):
+        self.dims = dims
+
+    def get_word_vector(self, word):
+        return _seeded(word, self.dims)
+
+
+class StubNLP():
+    """Stands in for the cltk pipeline, taking every word as its own lemma."""
+    class Doc():
+        def __init__(self, lemmata):
+            self.lemmata = lemmata
+
+    def __call__(self, text):
+        return self.Doc(text.lower().split())
+
+
+def stub_models(
+    lat_dims: int,
+    eng_dims: int
+) -> dict:
+    """The models of an `AventineSearch`, by name, for an index of these dims."""
+    return {
+        'eng_model': StubEncoder(eng_dims),
+        'lat_model': StubWordVectors(lat_dims),
+        'cltk_nlp': StubNLP()
+    }
+
+
+def synthetic_index(
+    sources_dir: Path,
+    index_dir: Path,
+    num_lemmata: int = 20000,
+    num_texts: int = 10,
+    texts_per_lemma: int = 3,
+    locs_per_lemma: int = 20,
+    chunks_per_text: int = 5000,
+    lat_dims: int = 100,
+    eng_dims: int = 768,
+    seed: int = 0
+) -> dict:
+    """
+    Writes a random index in the checkpoint layout of `ROOT_FINGERPRINT` and
+    `CORPUS_FINGERPRINT`, with metadata for every text in `sources_dir`, and
+    builds its root matrices. Each lemma occurs in `texts_per_lemma` texts,
+    at `locs_per_lemma` chunks of each. Returns the parameters it was built
+    with.
+    """
+    rng = np.random.default_rng(seed)
+    sources_dir, index_dir = Path(sources_dir), Path(index_dir)
+    os.makedirs(sources_dir / 'metadata', exist_ok=True)
+
+    lemmata = synthetic_lemmata(num_lemmata, seed)
+    text_ids = [f'bench.{i:04d}' for i in range(num_texts)]
+    texts_per_lemma = min(texts_per_lemma, num_texts)
+    locs_per_lemma = min(locs_per_lemma, chunks_per_text)
+
+    r = Bundler()
+    r.lemmata_arr = lemmata
+    r.lat_embeddings = list(rng.standard_normal((num_lemmata, lat_dims)).astype(np.float32))
+    r.eng_embeddings = list(rng.standard_normal((num_lemmata, eng_dims)).astype(np.float32))
+    r.definitions = [f'{lemma}, {lemma[:-1]}is: the {lemma} of {lemmata[i - 1]}'
+                     for i, lemma in enumerate(lemmata)]
+    r.root_lemmata_info = LargeDict()
+    r.existing_lemmata = set(lemmata)
+
+    corpora = {text_id: {} for text_id in text_ids}
+    for lemma in lemmata:
+        texts = rng.choice(num_texts, size=texts_per_lemma, replace=False)
+        r.root_lemmata_info[lemma] = {'texts': {text_ids[i] for i in texts}}
+        for i in texts:
+            locs = np.sort(rng.choice(chunks_per_text, size=locs_per_lemma, replace=False))
+            corpora[text_ids[i]][lemma] = {'count': locs_per_lemma, 'loc': locs.tolist()}
+    r.info = {'num_lemmata': num_lemmata}
+    Checkpointer(index_dir / 'root', ROOT_FINGERPRINT).save(r)
+
+    for e, text_id in enumerate(text_ids):
+        chunks = [[] for _ in range(chunks_per_text)]
+        for lemma, info in corpora[text_id].items():
+            for loc in info['loc']:
+                chunks[loc].append(lemma)
+
+        metadata = {
+            'key': text_id,
+            'text_id': text_id,
+            'schema': f'Perseus:text:{text_id}:chapter={{}}',
+            'title': f'Liber {e + 1}',
+            'author': 'Anonymus',
+            'editor': '',
+            'xml_fpath': str(sources_dir / f'{text_id}.xml'),
+            'txt_fpath': str(sources_dir / f'{text_id}.txt'),
+            'len_index': chunks_per_text,
+            'index': [f'{i // 100 + 1}.{i % 100 + 1}' for i in range(chunks_per_text)]
+        }
+        with open(sources_dir / 'metadata' / f'{text_id}.json', 'w', encoding='utf-8') as f:
+            json.dump(metadata, f)
+
+        c = Bundler()
+        c.meta = {'total': chunks_per_text, 'completed': chunks_per_text - 1,
+                  'num_lemmata': len(corpora[text_id])}
+        c.lemmatised = CHUNK_SEP.join(SMALL_SEP.join(chunk) for chunk in chunks)
+        c.corpus_lemmata_info = corpora[text_id]
+        Checkpointer(index_dir / text_id, CORPUS_FINGERPRINT).save(c)
+
+    build_root_matrices(index_dir / 'root')
+
+    return {
+        'num_lemmata': num_lemmata,
+        'num_texts': num_texts,
+        'texts_per_lemma': texts_per_lemma,
+        'locs_per_lemma': locs_per_lemma,
+        'chunks_per_text': chunks_per_text,
+        'lat_dims': lat_dims,
+        'eng_dims': eng_dims,
+        'seed': seed
+    }
+
+
+def synthetic_xml(
+    fpath: Path,
+    lemmata: list[str],
+    books: int = 10,
+    chapters: int = 100,
+    words_per_chapter: int = 120,
+    seed: int = 0
+) -> None:
+    """A Perseus-style TEI file of `books` books of `chapters` chapters each."""
+    rng = np.random.default_rng(seed)
+    with open(fpath, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<TEI.2>\n<teiHeader><fileDesc><titleStmt>'
+                '<title>Liber Synthesis</title><author>Anonymus</author><editor>Nemo</editor>'
+                '</titleStmt></fileDesc></teiHeader>\n<text><body>\n')
+        for book in range(1, books + 1):
+            f.write(f'<div1 type="book" n="{book}">\n')
+            for chapter in range(1, chapters + 1):
+                words = rng.choice(lemmata, size=words_per_chapter)
+                half = words_per_chapter // 2
+                f.write(f'<div2 type="chapter" n="{chapter}"><p>{" ".join(words[:half])}, '
+                        f'<note>{words[half]}</note> {" ".join(words[half + 1:])}.</p></div2>\n')
+            f.write('</div1>\n')
+        f.write('</body></text>\n</TEI.2>\n')
@@ -0,0 +1,198 @@
+import os
+import time
+import warnings
+import numpy as np
+from pathlib import Path
+
+from aventine.library.params import ROOT_MATRICES
+from aventine.library.params import ANN_LISTS, ANN_ITERATIONS, ANN_TRAINING_SAMPLE
+from aventine.library.utils import npy_dump, npy_mmap
+from aventine.library.utils import json_dump, json_load
+from aventine.library.matrices import matrix_path, read_matrix
+
+
+_BLOCK_ROWS = 65536
+
+
+def assign(unit_vects, centroids):
+    """Index of the most similar centroid for every row, computed in blocks."""
+    labels = np.empty(len(unit_vects), dtype=np.int64)
+    for start in range(0, len(unit_vects), _BLOCK_ROWS):
+        block = unit_vects[start:start + _BLOCK_ROWS]
+        labels[start:start + _BLOCK_ROWS] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+def spherical_kmeans(unit_vects, n_lists, iterations, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = np.array(
+        unit_vects[rng.choice(len(unit_vects), size=n_lists, replace=False)],
+        dtype=np.float32
+    )
+
+    for _ in range(iterations):
+        labels = assign(unit_vects, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, unit_vects)
+        norms = np.linalg.norm(sums, axis=1)
+
+        # Re-seed empty lists rather than letting them collapse
+        empty = norms == 0
+        if empty.any():
+            sums[empty] = unit_vects[rng.choice(len(unit_vects), size=empty.sum())]
+            norms[empty] = np.linalg.norm(sums[empty], axis=1)
+        centroids = (sums / norms[:, np.newaxis]).astype(np.float32)
+
+    return centroids
+
+
+class IVFIndex():
+    """
+    Inverted-file index over row-normalised vectors. Rows are bucketed by
+    their nearest k-means centroid and stored contiguously, so probing the
+    `nprobe` closest lists only scores a fraction of the matrix.
+    """
+
+    files = ('centroids', 'offsets', 'ids')
+
+    def __init__(self, centroids, offsets, ids):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        unit_vects,
+        n_lists: int = None,
+        iterations: int = ANN_ITERATIONS,
+        sample: int = ANN_TRAINING_SAMPLE,
+        seed: int = 0
+    ):
+        n = len(unit_vects)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(n)))
+        n_lists = min(n_lists, n)
+
+        rng = np.random.default_rng(seed)
+        training = unit_vects
+        if sample is not None and n > sample:
+            training = unit_vects[np.sort(rng.choice(n, size=sample, replace=False))]
+        centroids = spherical_kmeans(np.asarray(training), n_lists, iterations, seed)
+
+        labels = assign(unit_vects, centroids)
+        ids = np.argsort(labels, kind='stable')
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=n_lists))
+        return cls(centroids, offsets, ids)
+
+    def probe(self, a, nprobe):
+        """Sorted ids of every row in the `nprobe` lists closest to `a`."""
+        nprobe = min(nprobe, self.n_lists)
+        closeness = self.centroids @ a
+        lists = np.argpartition(closeness, -nprobe)[-nprobe:]
+        candidates = [self.ids[self.offsets[l]:self.offsets[l + 1]] for l in lists]
+        return np.sort(np.concatenate(candidates))
+
+    def save(self, save_dir: Path):
+        save_dir = Path(save_dir)
+        os.makedirs(save_dir, exist_ok=True)
+        for name in self.files:
+            npy_dump(getattr(self, name), save_dir / f'{name}.npy')
+
+    @classmethod
+    def load(cls, save_dir: Path):
+        save_dir = Path(save_dir)
+        return cls(*(npy_mmap(save_dir / f'{name}.npy') for name in cls.files))
+
+
+def ann_dir(root_dir: Path, name: str) -> Path:
+    return Path(root_dir) / 'ann' / name
+
+def matrix_signature(root_dir: Path, name: str) -> str:
+    """
+    Size and modification time of the matrix an index was built from, which
+    change whenever it is rewritten, even if its rows are only reordered.
+    """
+    stat = os.stat(matrix_path(root_dir, name))
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+def build_ann_indices(
+    root_dir: Path,
+    n_lists: int = ANN_LISTS,
+    verbose: bool = True
+) -> dict[str, IVFIndex]:
+    indices = {}
+    for name in ROOT_MATRICES:
+        source = matrix_signature(root_dir, name)
+        unit_vects = read_matrix(matrix_path(root_dir, name))
+        if verbose:
+            print(f'|- Clustering {len(unit_vects)} rows of `{name}`...')
+        indices[name] = IVFIndex.build(unit_vects, n_lists=n_lists)
+        indices[name].save(ann_dir(root_dir, name))
+        json_dump({'matrix': source}, ann_dir(root_dir, name) / 'source.json')
+    return indices
+
+def load_ann_indices(
+    root_dir: Path,
+    num_rows: int
+) -> dict[str, IVFIndex]:
+    """Loads whichever ANN indices exist and still match the root matrices."""
+    indices = {}
+    for name in ROOT_MATRICES:
+        if not os.path.exists(ann_dir(root_dir, name) / 'ids.npy'):
+            continue
+        try:
+            source = json_load(ann_dir(root_dir, name) / 'source.json')['matrix']
+        except Exception:
+            source = None
+        index = IVFIndex.load(ann_dir(root_dir, name))
+        if len(index) != num_rows or source != matrix_signature(root_dir, name):
+            warnings.warn(f'ANN index for `{name}` is stale; falling back to exact search.')
+            continue
+        indices[name] = index
+    return indices
+
+
+def recall_at_k(
+    index: IVFIndex,
+    unit_vects,
+    k: int = 50,
+    nprobes: tuple = (1, 2, 4, 8, 16, 32),
+    num_queries: int = 200,
+    seed: int = 0
+) -> list[dict]:
+    """
+    Recall@k of `index` against a brute-force scan of `unit_vects`, using
+    randomly chosen rows as queries, for every `nprobe` setting.
+    """
+    k = min(k, len(unit_vects))
+    rng = np.random.default_rng(seed)
+    queries = unit_vects[rng.choice(len(unit_vects), size=min(num_queries, len(unit_vects)),
+                                    replace=False)]
+
+    start = time.perf_counter()
+    exact = [set(np.argpartition(unit_vects @ q, -k)[-k:]) for q in queries]
+    exact_time = (time.perf_counter() - start) / len(queries)
+
+    report = []
+    for nprobe in nprobes:
+        hits, start = 0, time.perf_counter()
+        for q, truth in zip(queries, exact):
+            candidates = index.probe(q, nprobe)
+            sims = unit_vects[candidates] @ q
+            top = candidates[np.argsort(sims)[-k:]]
+            hits += len(truth.intersection(top))
+        report.append({
+            'nprobe': nprobe,
+            'recall': hits / (k * len(queries)),
+            'latency': (time.perf_counter() - start) / len(queries),
+            'exact_latency': exact_time
+        })
+    return report
@@ -1,8 +1,22 @@
+import gc
+
+from aventine.library.params import MODE, PRELOAD_MODELS
 from aventine.library.params import SOURCES_DIR, INDEX_DIR, TOOL_DIR
 from aventine.library.search import AventineSearch
+from aventine.library.scheduler import BatchScheduler
 
 default_engine = AventineSearch(
     sources_dir=SOURCES_DIR,
     index_dir=INDEX_DIR,
     tool_dir=TOOL_DIR
 )
+
+# Concurrent requests share batched encodes and similarity passes
+default_scheduler = BatchScheduler(default_engine)
+
+if MODE == 'SEARCH':
+    default_engine.warmup(PRELOAD_MODELS)
+
+# Keep the collector away from the (read-only) index, so that workers forked
+# with `gunicorn --preload` share its pages copy-on-write
+gc.freeze()
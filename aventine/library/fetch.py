@@ -0,0 +1,157 @@
+import os
+import hashlib
+import threading
+import requests
+from tqdm import tqdm
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from aventine.library.params import FETCH_WORKERS, FETCH_RETRIES, FETCH_BACKOFF, FETCH_TIMEOUT
+from aventine.library.params import HTTP_CACHE_DIR, FETCH_MANIFEST_FPATH
+from aventine.library.utils import json_dump, json_load
+from aventine.library.files import perseus_xml_get
+
+
+def pooled_session(
+    pool_size: int = FETCH_WORKERS,
+    retries: int = FETCH_RETRIES,
+    backoff: float = FETCH_BACKOFF
+) -> requests.Session:
+    """A session keeping `pool_size` connections per host, retrying with backoff."""
+    retry = Retry(total=retries,
+                  backoff_factor=backoff,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET', 'HEAD'))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class CachedSession():
+    """
+    Wraps a session with an on-disk HTTP cache. Responses carrying an ETag
+    or Last-Modified header are kept, and revalidated with a conditional
+    request the next time; a 304 is answered from the cache as a 200.
+    """
+    def __init__(self,
+                 session: requests.Session = None,
+                 cache_dir: Path = HTTP_CACHE_DIR,
+                 timeout: float = FETCH_TIMEOUT):
+        self.session = session or pooled_session()
+        self.cache_dir = Path(cache_dir)
+        self.timeout = timeout
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _paths(self, url: str) -> tuple['body', 'headers']:
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return self.cache_dir / f'{digest}.body', self.cache_dir / f'{digest}.json'
+
+    def _cached(self, body_fpath: Path, headers_fpath: Path) -> dict:
+        """
+        The validators of a cached response, or nothing if there is none. An
+        entry left half-written by an interrupted run is dropped.
+        """
+        tmp_fpaths = (body_fpath.with_suffix('.body.tmp'), headers_fpath.with_suffix('.tmp'))
+        if os.path.exists(body_fpath) and os.path.exists(headers_fpath) and \
+           not any(os.path.exists(fpath) for fpath in tmp_fpaths):
+            try:
+                return json_load(headers_fpath)
+            except ValueError:
+                pass
+        for fpath in (body_fpath, headers_fpath) + tmp_fpaths:
+            if os.path.exists(fpath):
+                os.remove(fpath)
+        return {}
+
+    def get(self, url: str) -> requests.Response:
+        body_fpath, headers_fpath = self._paths(url)
+
+        validators = {}
+        cached = self._cached(body_fpath, headers_fpath)
+        if cached:
+            if 'etag' in cached:
+                validators['If-None-Match'] = cached['etag']
+            if 'last_modified' in cached:
+                validators['If-Modified-Since'] = cached['last_modified']
+
+        response = self.session.get(url, headers=validators, timeout=self.timeout)
+
+        if response.status_code == 304 and validators:
+            with open(body_fpath, 'rb') as f:
+                response._content = f.read()
+            response.status_code = 200
+            return response
+
+        cached = {}
+        if 'ETag' in response.headers:
+            cached['etag'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            cached['last_modified'] = response.headers['Last-Modified']
+        if response.status_code == 200 and cached:
+            # Not `.tmp`, which `json_dump` uses for the headers
+            with open(body_fpath.with_suffix('.body.tmp'), 'wb') as f:
+                f.write(response.content)
+            os.replace(body_fpath.with_suffix('.body.tmp'), body_fpath)
+            json_dump(cached, headers_fpath)
+        return response
+
+
+class FetchManifest():
+    """
+    The outcome of fetching each text, saved after every one so that an
+    interrupted harvest resumes where it stopped.
+    """
+    def __init__(self, fpath: Path = FETCH_MANIFEST_FPATH):
+        self.fpath = Path(fpath)
+        self.entries = json_load(self.fpath) if os.path.exists(self.fpath) else {}
+        self._lock = threading.Lock()
+
+    def done(self, text_id: str) -> bool:
+        return 'metadata' in self.entries.get(text_id, {})
+
+    def record(self, text_id: str, metadata: dict = None, error: str = None):
+        with self._lock:
+            self.entries[text_id] = {'metadata': metadata} if error is None else {'error': error}
+            os.makedirs(self.fpath.parent, exist_ok=True)
+            json_dump(self.entries, self.fpath)
+
+
+def fetch_texts(
+    text_ids: list,
+    save_dir: Path,
+    workers: int = FETCH_WORKERS,
+    manifest_fpath: Path = FETCH_MANIFEST_FPATH,
+    cache_dir: Path = HTTP_CACHE_DIR,
+    overwrite: bool = False
+) -> dict:
+    """
+    `perseus_xml_get` for each of `text_ids`, `workers` at a time over one
+    pooled, cached session. Texts already in the manifest are skipped and
+    failures are recorded there rather than raised. Returns the metadata of
+    every text fetched so far, by id.
+    """
+    manifest = FetchManifest(manifest_fpath)
+    session = CachedSession(pooled_session(pool_size=workers), cache_dir=cache_dir)
+    todo = [i for i in text_ids if overwrite or not manifest.done(i)]
+
+    with ThreadPoolExecutor(workers) as executor:
+        futures = {
+            executor.submit(perseus_xml_get, text_id, save_dir, overwrite=overwrite, get=session.get): text_id
+            for text_id in todo
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Fetching'):
+            text_id = futures[future]
+            try:
+                manifest.record(text_id, metadata=future.result())
+            except Exception as e:
+                manifest.record(text_id, error=f'{type(e).__name__}: {e}')
+
+    return {
+        text_id: manifest.entries[text_id]['metadata']
+        for text_id in text_ids if manifest.done(text_id)
+    }
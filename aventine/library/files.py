@@ -5,7 +5,8 @@ import requests
 from pathlib import Path
 from urllib.parse import quote, unquote
 from bs4 import BeautifulSoup
-from bs4.element import Tag
+from lxml import etree
+from collections import deque
 
 
 from aventine.library.params import SMALL_SEP, CHUNK_SEP
@@ -14,11 +15,17 @@ from aventine.library.utils import normalise_text
 
 
 def perseus_collect(
-    url: str = 'https://www.perseus.tufts.edu/hopper/collection?collection=Perseus:corpus:perseus,Latin Texts'
+    url: str = 'https://www.perseus.tufts.edu/hopper/collection?collection=Perseus:corpus:perseus,Latin Texts',
+    get = None
 ):
+    """
+    Maps the id of every text listed at `url` to its title. `get` fetches
+    a URL, e.g. the `get` of a pooled session; by default `requests.get`.
+    """
+    get = get or requests.get
     extract_text_id = lambda x : unquote(x).split(':')[-1]
 
-    collection = requests.get(url)
+    collection = get(url)
     soup = BeautifulSoup(collection.content, 'html.parser')
     return {
         extract_text_id(link['href']): link.text.strip()
@@ -42,16 +49,19 @@ def perseus_xml_get(
     existing_keys: list = [],
     text_stem: str = 'https://www.perseus.tufts.edu/hopper/text?doc=Perseus:text:{}',
     server_stem: str = 'https://www.perseus.tufts.edu/hopper/{}',
-    overwrite: bool = False
+    overwrite: bool = False,
+    get = None
 ) -> dict:
     
+    get = get or requests.get
     save_dir = Path(save_dir)
     os.makedirs(save_dir, exist_ok=True)
 
     _key = text_id # randkey(existing_keys)
     fpath = save_dir / f'{_key}.xml'
 
-    text_data = requests.get(text_stem.format(text_id))
+    text_data = get(text_stem.format(text_id))
+    text_data.raise_for_status()
     soup = BeautifulSoup(text_data.content, 'html.parser')
     group = soup.find('p', attrs={'class': 'xml_download'})
     xml_url = server_stem.format(group.find('a')['href'])
@@ -61,10 +71,13 @@ def perseus_xml_get(
     schema = f"{'+'.join(schema_example.split(' ')[:-1])}+{{}}"
 
     if overwrite or not os.path.exists(fpath):
-        xml_data = requests.get(xml_url)
+        xml_data = get(xml_url)
+        xml_data.raise_for_status()
         
-        with open(fpath, "wb") as f:
+        # Never leave a partial download where a complete one is expected
+        with open(fpath.with_suffix('.tmp'), "wb") as f:
             f.write(xml_data.content)
+        os.replace(fpath.with_suffix('.tmp'), fpath)
 
     return {
         'key': _key,
@@ -81,53 +94,125 @@ def ext(id, new_ext):
         return new_ext
     return f'{id}.{new_ext}'
 
-def signature(tag):
+def signature(element):
     return (
-        tag.name,
-        tag['type'] if 'type' in tag.attrs else None,
-        tag['unit'] if 'unit' in tag.attrs else None
+        tag_name(element),
+        element.get('type'),
+        element.get('unit')
     )
 
 
 _whitespaces = re.compile(rf'[{CHUNK_SEP}\r\t]+')
 
+def tag_name(element) -> str:
+    qname = etree.QName(element)
+    return f'{element.prefix}:{qname.localname}' if element.prefix else qname.localname
+
 def linear_parse(
-    body: Tag
-) -> str:
-    
-    collated = ''
-    index = []
+    xml_fpath: Path,
+    header: tuple = ('title', 'author', 'editor'),
+    read_size: int = 2**20
+) -> tuple['collated', 'index', 'header']:
+    """
+    Splits the first `body` of a Perseus XML file into chunks, one for every
+    run of text under the same citation, in a single streaming pass. Every
+    element's text is assembled from its children's as they close, and the
+    children are then dropped, so only the open elements are ever held. Also
+    returns the text of the first element named in `header`, by name.
+    """
+    chunks, index = [], []
     levels, signatures = [], []
     current_signature = None
     began = False
     written = False
 
-    for element in body.find_all():
-        if 'n' in element.attrs and element.name not in {'l'}:
-            began = True
-            written = False
-            if signature(element) == current_signature:
-                levels.pop()
-                levels.append(element['n'])
+    # Work is queued in document order, as citation markers and slots for the
+    # text of each element, which is only known once the element closes
+    queue = deque()
+
+    def drain():
+        nonlocal levels, signatures, current_signature, began, written
+        while queue and queue[0][0] is not None:
+            text, element_signature, n = queue.popleft()
+            if n is not None:
+                began = True
+                written = False
+                if element_signature == current_signature:
+                    levels.pop()
+                    levels.append(n)
+                else:
+                    current_signature = element_signature
+                    try:
+                        end = signatures.index(current_signature)
+                    except ValueError:
+                        end = len(signatures)
+                    levels = levels[:end] + [n]
+                    signatures = signatures[:end] + [current_signature]
             else:
-                current_signature = signature(element)
-                try:
-                    end = signatures.index(current_signature)
-                except:
-                    end = len(signatures)
-                levels = levels[:end] + [element['n']]
-                signatures = signatures[:end] + [current_signature]
-        
-        else:
-            new_text = re.sub(_whitespaces, ' ', element.text).strip()
-            if began and new_text != '':
-                if not written:
-                    collated = collated.strip() + CHUNK_SEP
-                    index.append('.'.join(levels))
-                    written = True
-                collated += new_text + SMALL_SEP
+                new_text = re.sub(_whitespaces, ' ', text).strip()
+                if began and new_text != '':
+                    if not written:
+                        chunks.append([])
+                        index.append('.'.join(levels))
+                        written = True
+                    chunks[-1].append(new_text)
+
+    found = {}
+    stack = []                  # (texts of closed children, queue slot, header) per open element
+    body_depth, seen_body = None, False
+
+    def handle(events):
+        nonlocal body_depth, seen_body
+        for event, element in events:
+            name = tag_name(element)
+
+            if event == 'start':
+                slot = None
+                if body_depth is not None:
+                    if element.get('n') is not None and name not in {'l'}:
+                        queue.append(['', signature(element), element.get('n')])
+                    else:
+                        slot = [None, None, None]
+                        queue.append(slot)
+                elif name == 'body' and not seen_body:
+                    body_depth, seen_body = len(stack), True
+                # The first header element to open is the one reported, as with `find`
+                first = name in header and name not in found
+                if first:
+                    found[name] = None
+                stack.append(([], slot, first))
+                continue
 
-    return normalise_text(collated, ALLOWED_SYMBOLS, ALLOWED_PUNCTS), index
+            texts, slot, first = stack.pop()
+            texts, parts = iter(texts), [element.text or '']
+            for child in element:
+                # Comments and processing instructions only contribute their tails
+                if isinstance(child.tag, str):
+                    parts.append(next(texts))
+                parts.append(child.tail or '')
+            text = ''.join(parts)
+            del element[:]
+
+            if stack:
+                stack[-1][0].append(text)
+            if first:
+                found[name] = text
+            if slot is not None:
+                slot[0] = text
+                drain()
+            if body_depth == len(stack):
+                body_depth = None
+
+    parser = etree.XMLPullParser(events=('start', 'end'), recover=True, strip_cdata=False)
+    with open(xml_fpath, 'r', encoding='utf-8') as f:
+        while data := f.read(read_size):
+            parser.feed(data)
+            handle(parser.read_events())
+    parser.close()
+    handle(parser.read_events())
+
+    collated = CHUNK_SEP.join(SMALL_SEP.join(chunk) for chunk in chunks)
+    return normalise_text(collated, ALLOWED_SYMBOLS, ALLOWED_PUNCTS), index, found
 
 
 def perseus_xml2txt(
@@ -145,16 +230,8 @@ def perseus_xml2txt(
         with open(json_path, 'r') as f:
             return json.load(f)
     
-    with open(metadata['xml_fpath'], 'r', encoding='utf-8') as f:
-        xml_data = f.read()
-    
-    soup = BeautifulSoup(xml_data, features="xml")
-    quick_extract = lambda x : soup.find(x).text.strip()
-
-    title, author, editor = (quick_extract(i) for i in ('title', 'author', 'editor'))
-
-    body = soup.find('body')
-    collated, index = linear_parse(body)
+    collated, index, header = linear_parse(metadata['xml_fpath'])
+    title, author, editor = (header[i].strip() for i in ('title', 'author', 'editor'))
 
     metadata.update({'title': title,
                      'author': author,
@@ -182,3 +259,16 @@ def perseus_url(
 ) -> str:
     url = stem.format(metadata['schema'].format(quote_id), metadata['text_id'])
     return quote(url, safe='.:/?&+=')
+
+def perseus_urls(
+    metadata: dict,
+    stem: str = "https://www.perseus.tufts.edu/hopper/text?doc={}&fromdoc=Perseus:text:{}"
+) -> list[str]:
+    """
+    `perseus_url` for every entry of `metadata['index']`, quoting the parts of
+    the URL around the citation only once.
+    """
+    safe = '.:/?&+='
+    template = stem.format(metadata['schema'], metadata['text_id'])
+    prefix, suffix = (quote(part, safe=safe) for part in template.split('{}', 1))
+    return [prefix + quote(quote_id, safe=safe) + suffix for quote_id in metadata['index']]
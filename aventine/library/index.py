@@ -1,38 +1,262 @@
 import re
 import os
+import time
+import hashlib
+import bisect
 import warnings
+import multiprocessing
 from tqdm import tqdm
 from pathlib import Path
 
-import cltk
-from cltk import NLP
-from sentence_transformers import SentenceTransformer
-
 from aventine.library.params import CHUNK_SEP
 from aventine.library.params import ROOT_FINGERPRINT, CORPUS_FINGERPRINT
 from aventine.library.params import ALLOWED_LEMMATA, BAD_LEMMATA
-from aventine.library.params_ml import SENTENCE_TRANSFORMER_MODEL as ENG_MODEL
-from aventine.library.params_ml import WORD_EMBEDDING_MODEL as LAT_MODEL
+from aventine.library.params import CHECKPOINT_FLUSH_EVERY, CHECKPOINT_COMPACT_EVERY
+from aventine.library.params import INDEX_WORKERS, INDEX_POOL_CHUNKSIZE
+from aventine.library.params import INDEX_BATCH_TOKENS
+from aventine.library.params import DEFINITION_BATCH_SIZE, DEFINITION_CACHE_SIZE
+from aventine.library.models import get_model
 from aventine.library.wordvec import Corpus, train_word2vec_model
 from aventine.library.utils import Checkpointer
-from aventine.library.utils import meanings
-from aventine.library.utils import strfseconds, get_null, replace_if_none
+from aventine.library.journal import Journal
+from aventine.library.www import WordsPool
+from aventine.library.utils import strfseconds, replace_if_none
+from aventine.library.utils import LRUCache
+from aventine.library import metrics
+
+
+BATCH_SEP = '\n\n'
+
+_stages = metrics.histogram('aventine_index_stage_seconds',
+                            'Time spent in each stage of indexing, per chunk or per call.', label='stage')
+
+
+def _indexable(lemma, pos):
+    return pos != 'PUNCT' and re.fullmatch(ALLOWED_LEMMATA, lemma) and lemma not in BAD_LEMMATA
+
+def analyse(cltk_nlp, text):
+    """The `(lemma, token)` pairs of the indexable words in a chunk of text."""
+    doc = cltk_nlp.analyze(text)
+    return [(lemma, token) for lemma, token, pos in zip(doc.lemmata, doc.tokens, doc.pos)
+            if _indexable(lemma, pos)]
+
+def analyse_batch(cltk_nlp, texts):
+    """
+    `analyse` of each of `texts`, from a single pipeline call over all of them.
+    Chunks are joined by blank lines, which Stanza always treats as sentence
+    breaks. cltk's Stanza process reports no character offsets, so words are
+    returned to their chunk by finding each in turn in the text the pipeline
+    analysed (normalised, if it was). Falls back to one call per chunk if a
+    word cannot be found where the previous one ended.
+    """
+    if len(texts) == 1:
+        return [analyse(cltk_nlp, texts[0])]
+
+    doc = cltk_nlp.analyze(BATCH_SEP.join(texts))
+    analysed = getattr(doc, 'normalized_text', None) or BATCH_SEP.join(texts)
+
+    # Chunks hold no line breaks, so normalisation leaves the separators be
+    parts = analysed.split(BATCH_SEP)
+    if len(parts) != len(texts):
+        return [analyse(cltk_nlp, text) for text in texts]
+    starts, offset = [], 0
+    for part in parts:
+        starts.append(offset)
+        offset += len(part) + len(BATCH_SEP)
+
+    words = [[] for _ in texts]
+    cursor = 0
+    for word in doc.words:
+        start = analysed.find(word.string, cursor) if word.string else -1
+        # Only whitespace may lie between consecutive words
+        if start < 0 or analysed[cursor:start].strip():
+            return [analyse(cltk_nlp, text) for text in texts]
+        cursor = start + len(word.string)
+        i = bisect.bisect_right(starts, start) - 1
+        if cursor > starts[i] + len(parts[i]):
+            return [analyse(cltk_nlp, text) for text in texts]
+        if _indexable(word.lemma, word.upos):
+            words[i].append((word.lemma, word.string))
+    return words
 
+def batches(chunks, max_tokens=INDEX_BATCH_TOKENS):
+    """Groups consecutive chunks into batches of at most `max_tokens` words."""
+    if not max_tokens:
+        yield from ([text] for text in chunks)
+        return
+
+    batch, tokens = [], 0
+    for text in chunks:
+        size = len(text.split())
+        if batch and tokens + size > max_tokens:
+            yield batch
+            batch, tokens = [], 0
+        batch.append(text)
+        tokens += size
+    if batch:
+        yield batch
+
+def _analyse_in_worker(texts):
+    return analyse_batch(get_model('cltk_nlp'), texts)
+
+def analyses(chunks, workers=1, max_tokens=INDEX_BATCH_TOKENS, chunksize=INDEX_POOL_CHUNKSIZE):
+    """
+    Yields `analyse` of every chunk in order, lemmatising `batches` of them
+    at a time. With several `workers`, batches are lemmatised by a pool of
+    processes, each with its own cltk pipeline, and handed back in order.
+    """
+    if workers <= 1:
+        cltk_nlp = get_model('cltk_nlp')
+        for texts in batches(chunks, max_tokens):
+            yield from analyse_batch(cltk_nlp, texts)
+        return
+
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        for words in pool.imap(_analyse_in_worker, batches(chunks, max_tokens), chunksize=chunksize):
+            yield from words
+
+def analysis_throughput(chunks, budgets=(None, 250, 1000, 4000), workers=1) -> list[dict]:
+    """Chunks lemmatised per second at each batch token budget."""
+    get_model('cltk_nlp')
+    report = []
+    for max_tokens in budgets:
+        start = time.perf_counter()
+        for _ in analyses(chunks, workers=workers, max_tokens=max_tokens):
+            pass
+        elapsed = time.perf_counter() - start
+        report.append({
+            'max_tokens': max_tokens,
+            'chunks_per_sec': len(chunks) / elapsed,
+            'elapsed': elapsed
+        })
+    return report
+
+
+def chunk_delta(words, chunk_index, r, key, www):
+    """
+    Everything that indexing one analysed chunk adds to the root (`r`) and
+    corpus checkpoints, without modifying either; see `apply_delta`. English
+    embeddings of new definitions are left as None for `DefinitionEncoder`.
+    """
+    lat_model = get_model('lat_model')
+    lat_none = get_model('lat_none')
+    lemmata, new_lemmata, new_tokens, gained = [], [], [], []
+    seen = set()
+
+    for lemma, token in words:
+        lemmata.append(lemma)
+        if lemma in seen:
+            continue
+        seen.add(lemma)
+
+        if lemma in r.existing_lemmata:
+            if key not in r.root_lemmata_info[lemma]['texts']:
+                gained.append(lemma)
+        else:
+            new_lemmata.append(lemma)
+            new_tokens.append(token)
+    new_defs = www.meanings(new_tokens)
 
-lat_model = LAT_MODEL('lat')
-eng_model = SentenceTransformer(ENG_MODEL, trust_remote_code=True)
-lat_none, _ = get_null(lat_model, eng_model)
+    return {
+        'seq': chunk_index,
+        'lemmata': lemmata,
+        'gained': gained,
+        'new': list(zip(
+            new_lemmata,
+            [replace_if_none(lat_model.get_word_vector(w), lat_none) for w in new_lemmata],
+            new_defs,
+            [None] * len(new_defs)
+        )),
+        'meta': {}
+    }
 
-cltk_nlp = NLP(language="lat")
-cltk_nlp.pipeline.processes = [
-    cltk.alphabet.processes.LatinNormalizeProcess,
-    cltk.dependency.processes.LatinStanzaProcess
-]
+class DefinitionEncoder():
+    """
+    Holds back indexed chunks until the definitions they introduce have been
+    encoded, so that these are encoded many at a time: shortest first, and
+    each distinct string once through a cache keyed by its hash.
+    """
+    def __init__(self,
+                 r,
+                 batch_size: int = DEFINITION_BATCH_SIZE,
+                 cache_size: int = DEFINITION_CACHE_SIZE):
+        self.r = r
+        self.batch_size = batch_size
+        self.cache = LRUCache(cache_size)
+        self.pending = []
+        self.num_definitions = 0
+
+    def put(self, delta, row):
+        """Queues an applied `delta` whose first new lemma is root row `row`."""
+        self.pending.append((delta, row))
+        self.num_definitions += len(delta['new'])
+
+    def due(self):
+        return self.num_definitions == 0 or self.num_definitions >= self.batch_size
+
+    def encode(self, definitions):
+        keys = [hashlib.sha1(i.encode('utf-8')).hexdigest() for i in definitions]
+        vects = {k: v for k in set(keys) if (v := self.cache.get(k)) is not None}
+        missing = {k: i for k, i in zip(keys, definitions) if k not in vects}
+
+        if missing:
+            order = sorted(missing, key=lambda k: len(missing[k]))
+            encoded = get_model('eng_model').encode([missing[k] for k in order])
+            for k, v in zip(order, encoded):
+                vects[k] = v
+                self.cache.put(k, v)
+        return [vects[k] for k in keys]
+
+    def drain(self):
+        """Encodes every queued definition, returning the completed deltas in order."""
+        definitions = [i[2] for delta, _ in self.pending for i in delta['new']]
+        vects = self.encode(definitions) if definitions else []
+
+        done, offset = [], 0
+        for delta, row in self.pending:
+            n = len(delta['new'])
+            delta['new'] = [(lemma, lat_embedding, definition, eng_embedding)
+                            for (lemma, lat_embedding, definition, _), eng_embedding
+                            in zip(delta['new'], vects[offset:offset + n])]
+            self.r.eng_embeddings[row:row + n] = vects[offset:offset + n]
+            offset += n
+            done.append(delta)
+
+        self.pending, self.num_definitions = [], 0
+        return done
+
+
+def apply_delta(r, c, key, delta, root=True, corpus=True):
+    if root:
+        for lemma, lat_embedding, definition, eng_embedding in delta['new']:
+            r.existing_lemmata.add(lemma)
+            r.root_lemmata_info[lemma] = {'texts': {key}}
+            r.lemmata_arr.append(lemma)
+            r.lat_embeddings.append(lat_embedding)
+            r.definitions.append(definition)
+            r.eng_embeddings.append(eng_embedding)
+        for lemma in delta['gained']:
+            r.root_lemmata_info[lemma]['texts'].add(key)
+        r.info['num_lemmata'] = len(r.root_lemmata_info)
+
+    if corpus:
+        for lemma in delta['lemmata']:
+            if lemma in c.corpus_lemmata_info:
+                c.corpus_lemmata_info[lemma]['count'] += 1
+                c.corpus_lemmata_info[lemma]['loc'].append(delta['seq'])
+            else:
+                c.corpus_lemmata_info[lemma] = {'count': 1, 'loc': [delta['seq']]}
+        c.lemmatised += ' '.join(delta['lemmata']) + '\n'
+        c.meta.update(delta['meta'])
+        c.meta['num_lemmata'] = len(c.corpus_lemmata_info)
 
 
 def preprocess(file_metadata: dict,
                save_dir: Path,
-               tool_dir: Path):
+               tool_dir: Path,
+               flush_every: int = CHECKPOINT_FLUSH_EVERY,
+               compact_every: int = CHECKPOINT_COMPACT_EVERY,
+               workers: int = INDEX_WORKERS):
     
     text_fpath, save_dir = Path(file_metadata['txt_fpath']), Path(save_dir)
     name = file_metadata['title']
@@ -41,11 +265,43 @@ def preprocess(file_metadata: dict,
     def run_pipeline(chunks):
         root_ckpt = Checkpointer(save_dir / 'root', ROOT_FINGERPRINT)
         corpus_ckpt = Checkpointer(save_dir / key, CORPUS_FINGERPRINT)
+        journal = Journal(save_dir / key / 'journal')
         c = corpus_ckpt.load()
         r = root_ckpt.load()
 
+        # Chunks since the last compaction live only in the journal. Either
+        # checkpoint may already hold some of them if compaction was cut short.
+        r.info.setdefault('compacted', {})
+        root_seq = r.info['compacted'].get(key, -1)
+        corpus_seq = c.meta.get('compacted', -1)
+        with metrics.timer(_stages, 'replay'):
+            for delta in journal.replay():
+                apply_delta(r, c, key, delta,
+                            root=delta['seq'] > root_seq,
+                            corpus=delta['seq'] > corpus_seq)
+
+        encoder = DefinitionEncoder(r)
+
+        def compact():
+            drain()
+            with metrics.timer(_stages, 'journal'):
+                journal.flush()
+            if 'completed' in c.meta:
+                r.info['compacted'][key] = c.meta['completed']
+                c.meta['compacted'] = c.meta['completed']
+            with metrics.timer(_stages, 'checkpoint'):
+                root_ckpt.save(r)
+                corpus_ckpt.save(c)
+                journal.clear()
+
+        def drain():
+            with metrics.timer(_stages, 'encode'):
+                done = encoder.drain()
+            with metrics.timer(_stages, 'journal'):
+                for delta in done:
+                    journal.append(delta)
+
         if not c.meta:
-            c.meta = {'total': len(chunks)}
             start = 0
             print(f'Starting from scratch.')
         else:
@@ -54,60 +310,42 @@ def preprocess(file_metadata: dict,
         iter = tqdm(range(start, len(chunks)))
         iter.set_description(name)
 
+        # Lemmatisation may run ahead in other processes; everything else is
+        # merged here, in chunk order, so the index matches a serial run
+        words_iter = analyses(chunks[start:], workers=workers)
+
         for chunk_index in iter:
 
-            text = chunks[chunk_index]
-            doc = cltk_nlp.analyze(text)
-
-            word_filter = [e for e, pos in enumerate(doc.pos) if pos != 'PUNCT']
-            lemmata, new_lemmata, new_defs = [], [], []
-
-            for i in word_filter:
-                lemma = doc.lemmata[i]
-
-                if not re.fullmatch(ALLOWED_LEMMATA, lemma) or lemma in BAD_LEMMATA:
-                    continue
-
-                lemmata.append(lemma)
-                
-                _k = lemma
-                if _k in r.existing_lemmata:
-                    if key not in r.root_lemmata_info[_k]['texts']:
-                        r.root_lemmata_info[_k]['texts'].add(key)
-                        c.corpus_lemmata_info[_k] = {'count': 1, 'loc': [chunk_index]}
-                    else:
-                        c.corpus_lemmata_info[_k]['count'] += 1
-                        c.corpus_lemmata_info[_k]['loc'].append(chunk_index)
-                
-                else:
-                    r.existing_lemmata.add(_k)
-                    r.root_lemmata_info[_k] = {'texts': {key}}
-                    c.corpus_lemmata_info[_k] = {'count': 1, 'loc': [chunk_index]}
-                    
-                    www_meaning = meanings(doc.tokens[i], tool_dir=tool_dir)
-                    new_lemmata.append(lemma)
-                    new_defs.append(www_meaning)
-            
-            r.lemmata_arr.extend(new_lemmata)
-            r.lat_embeddings.extend([
-                replace_if_none(lat_model.get_word_vector(w), lat_none) for w in new_lemmata
-            ])
-            r.definitions.extend(new_defs)
-            r.eng_embeddings.extend(eng_model.encode(new_defs))
-            c.lemmatised += ' '.join(lemmata) + '\n'
-
-            r.info['num_lemmata'] = len(r.root_lemmata_info)
-            c.meta['num_lemmata'] = len(c.corpus_lemmata_info)
-            c.meta['completed'] = chunk_index
+            # Lemmatisation in other processes only shows up here when it falls behind
+            with metrics.timer(_stages, 'lemmatise'):
+                words = next(words_iter)
+
+            with metrics.timer(_stages, 'lookup'):
+                delta = chunk_delta(words, chunk_index, r, key, www)
+            delta['meta'] = {'total': len(chunks), 'completed': chunk_index}
             if iter.format_dict['rate'] is not None:
-                c.meta['eta'] = '+' + strfseconds(
+                delta['meta']['eta'] = '+' + strfseconds(
                     (iter.format_dict['total'] - iter.format_dict['n'] - 1) / iter.format_dict['rate']
                 )
+            row = len(r.lemmata_arr)
+            with metrics.timer(_stages, 'apply'):
+                apply_delta(r, c, key, delta)
+            encoder.put(delta, row)
             
-            assert r.info['num_lemmata'] == len(r.existing_lemmata) == len(r.lat_embeddings)
+            assert r.info['num_lemmata'] == len(r.existing_lemmata) == len(r.lat_embeddings) \
+                == len(r.lemmata_arr) == len(r.definitions) == len(r.eng_embeddings)
             
-            root_ckpt.save(r)
-            corpus_ckpt.save(c)
+            # Chunks reach the journal only once their definitions are encoded
+            if (chunk_index - start + 1) % compact_every == 0:
+                compact()
+            else:
+                if encoder.due():
+                    drain()
+                if (chunk_index - start + 1) % flush_every == 0:
+                    with metrics.timer(_stages, 'journal'):
+                        journal.flush()
+        
+        compact()
         
         # Final word2vec pass
         word2vec_fpath = str(save_dir / key / 'word2vec.model')
@@ -116,14 +354,20 @@ def preprocess(file_metadata: dict,
             model = Word2Vec.load(word2vec_fpath)
             warnings.warn(f'Word2Vec model already exists at {word2vec_fpath}.')
         else:
-            model = train_word2vec_model(
-                Corpus(save_dir / key / 'lemmatised.txt')
-            )
-            model.save(word2vec_fpath)
+            with metrics.timer(_stages, 'word2vec'):
+                model = train_word2vec_model(
+                    Corpus(save_dir / key / 'lemmatised.txt')
+                )
+                model.save(word2vec_fpath)
 
         return model
     
     with open(text_fpath, 'r', encoding='utf-8') as f:
         corpus = f.read()
     
-    run_pipeline(corpus.split(CHUNK_SEP))
+    with WordsPool(tool_dir) as www:
+        run_pipeline(corpus.split(CHUNK_SEP))
+
+    if metrics.METRICS:
+        print('Indexing time by stage so far:')
+        print(metrics.summary(_stages))
@@ -0,0 +1,92 @@
+import os
+import zlib
+import struct
+import warnings
+import pickle as pkl
+from pathlib import Path
+
+from aventine.library.params import JOURNAL_SEGMENT_BYTES
+
+
+_header = struct.Struct('<II')     # payload length, crc32 of payload
+
+
+def frame(record) -> bytes:
+    payload = pkl.dumps(record, protocol=pkl.HIGHEST_PROTOCOL)
+    return _header.pack(len(payload), zlib.crc32(payload)) + payload
+
+def unframe(data: bytes):
+    """
+    Yields `(record, end)` for every complete frame in `data`, where `end` is
+    the offset just past that frame; stops at the first torn or corrupt one.
+    """
+    offset = 0
+    while offset + _header.size <= len(data):
+        length, crc = _header.unpack_from(data, offset)
+        start, end = offset + _header.size, offset + _header.size + length
+        if end > len(data) or zlib.crc32(data[start:end]) != crc:
+            return
+        yield pkl.loads(data[start:end]), end
+        offset = end
+
+
+class Journal():
+    """
+    An append-only log of records split over numbered segment files. Records
+    are buffered in memory until `flush`, which appends and fsyncs them; a
+    torn write at the end of the log is discarded on `replay`.
+    """
+    def __init__(self,
+                 dir: Path,
+                 segment_bytes: int = JOURNAL_SEGMENT_BYTES):
+        self.dir = Path(dir)
+        self.segment_bytes = segment_bytes
+        self.buffer = []
+
+    def segments(self) -> list[Path]:
+        if not os.path.exists(self.dir):
+            return []
+        return sorted(self.dir / i for i in os.listdir(self.dir) if i.endswith('.log'))
+
+    def _segment_path(self, number: int) -> Path:
+        return self.dir / f'segment-{number:06d}.log'
+
+    def append(self, record):
+        self.buffer.append(frame(record))
+
+    def flush(self):
+        if not self.buffer:
+            return
+        os.makedirs(self.dir, exist_ok=True)
+
+        segments = self.segments()
+        fpath = segments[-1] if segments else self._segment_path(0)
+        if os.path.exists(fpath) and os.path.getsize(fpath) >= self.segment_bytes:
+            fpath = self._segment_path(int(fpath.stem.split('-')[-1]) + 1)
+
+        with open(fpath, 'ab') as f:
+            f.write(b''.join(self.buffer))
+            f.flush()
+            os.fsync(f.fileno())
+        self.buffer = []
+
+    def replay(self):
+        """Yields every complete record, truncating a torn tail if there is one."""
+        for fpath in self.segments():
+            with open(fpath, 'rb') as f:
+                data = f.read()
+
+            valid = 0
+            for record, valid in unframe(data):
+                yield record
+
+            if valid < len(data):
+                warnings.warn(f'Discarding {len(data) - valid} bytes of a torn write in {fpath}.')
+                with open(fpath, 'r+b') as f:
+                    f.truncate(valid)
+                return
+
+    def clear(self):
+        self.buffer = []
+        for fpath in self.segments():
+            os.remove(fpath)
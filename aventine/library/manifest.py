@@ -0,0 +1,243 @@
+import os
+import json
+import shutil
+import hashlib
+from pathlib import Path
+
+from aventine.library import params
+from aventine.library.params import ROOT_FINGERPRINT
+from aventine.library.utils import Checkpointer
+from aventine.library.utils import json_dump, json_load
+
+
+STAGES = ('txt', 'lemmatised', 'word2vec')
+
+
+def stage_params(stage: str) -> dict:
+    """The params whose values a stage's output depends on."""
+    if stage == 'txt':
+        return {
+            'ALLOWED_SYMBOLS': params.ALLOWED_SYMBOLS,
+            'ALLOWED_PUNCTS': params.ALLOWED_PUNCTS,
+            'SMALL_SEP': params.SMALL_SEP,
+            'CHUNK_SEP': params.CHUNK_SEP
+        }
+    if stage == 'lemmatised':
+        from aventine.library import params_ml
+        return {
+            'ALLOWED_LEMMATA': params.ALLOWED_LEMMATA.pattern,
+            'BAD_LEMMATA': sorted(params.BAD_LEMMATA),
+            'SENTENCE_TRANSFORMER_MODEL': params_ml.SENTENCE_TRANSFORMER_MODEL,
+            'WORD_EMBEDDING_MODEL': params_ml.WORD_EMBEDDING_MODEL.__qualname__
+        }
+    if stage in {'word2vec', 'root'}:
+        return {
+            'WORD2VEC_EPOCHS': params.WORD2VEC_EPOCHS,
+            'WORD2VEC_DIMS': params.WORD2VEC_DIMS
+        }
+    raise ValueError(f'Unknown stage `{stage}`.')
+
+
+def content_hash(stage: str, *fpaths: Path) -> str:
+    """Digest of the contents of a stage's input files and of its params."""
+    digest = hashlib.sha1(json.dumps(stage_params(stage), sort_keys=True).encode('utf-8'))
+    for fpath in fpaths:
+        with open(fpath, 'rb') as f:
+            while block := f.read(2**20):
+                digest.update(block)
+    return digest.hexdigest()
+
+def stage_inputs(metadata: dict, index_dir: Path) -> dict[str, Path]:
+    return {
+        'txt': Path(metadata['xml_fpath']),
+        'lemmatised': Path(metadata['txt_fpath']),
+        'word2vec': Path(index_dir) / metadata['key'] / 'lemmatised.txt'
+    }
+
+
+class BuildManifest():
+    """
+    The input hash every stage of every text was last built from, kept in
+    `root/manifest.json`, so that a rebuild can tell which outputs are stale.
+    """
+    def __init__(self, index_dir: Path):
+        self.fpath = Path(index_dir) / 'root' / 'manifest.json'
+        self.entries = json_load(self.fpath) if os.path.exists(self.fpath) else {}
+
+    def get(self, key: str, stage: str) -> str:
+        return self.entries.get(key, {}).get(stage)
+
+    def record(self, key: str, stage: str, digest: str):
+        self.entries.setdefault(key, {})[stage] = digest
+        os.makedirs(self.fpath.parent, exist_ok=True)
+        json_dump(self.entries, self.fpath)
+
+    def forget(self, key: str):
+        self.entries.pop(key, None)
+        json_dump(self.entries, self.fpath)
+
+    def record_text(self, metadata: dict, index_dir: Path):
+        """Records every stage of a freshly built text as up to date."""
+        for stage, fpath in stage_inputs(metadata, index_dir).items():
+            self.record(metadata['key'], stage, content_hash(stage, fpath))
+
+    def root_hash(self) -> str:
+        """The root model depends on the lemmatised text of every text."""
+        return hashlib.sha1(json.dumps(
+            [stage_params('root')] + [
+                (key, self.get(key, 'word2vec')) for key in sorted(self.entries) if key != 'root'
+            ]
+        ).encode('utf-8')).hexdigest()
+
+    def record_root(self):
+        self.record('root', 'word2vec', self.root_hash())
+
+
+def unindex_text(
+    index_dir: Path,
+    key: str
+) -> None:
+    """
+    Removes a text from the root index, dropping the lemmata no other text
+    contains along with their rows, and deletes the text's own directory.
+    """
+    index_dir = Path(index_dir)
+    root_ckpt = Checkpointer(index_dir / 'root', ROOT_FINGERPRINT)
+    r = root_ckpt.load()
+
+    orphans = set()
+    for lemma, info in r.root_lemmata_info.items():
+        info['texts'].discard(key)
+        if not info['texts']:
+            orphans.add(lemma)
+
+    keep = [i for i, lemma in enumerate(r.lemmata_arr) if lemma not in orphans]
+    for name in ('lemmata_arr', 'lat_embeddings', 'definitions', 'eng_embeddings'):
+        column = getattr(r, name)
+        setattr(r, name, [column[i] for i in keep])
+    for lemma in orphans:
+        del r.root_lemmata_info[lemma]
+        r.existing_lemmata.discard(lemma)
+    r.info.get('compacted', {}).pop(key, None)
+    r.info['num_lemmata'] = len(r.root_lemmata_info)
+
+    # `Checkpointer.save` skips empty properties, which would leave stale files
+    root_ckpt.save(r)
+    for prop, _type in ROOT_FINGERPRINT.items():
+        if getattr(r, prop) == _type():
+            _t = _type if _type in Checkpointer.save_formats else None
+            fpath = index_dir / 'root' / f'{prop}.{Checkpointer.save_formats[_t][1]}'
+            if os.path.exists(fpath):
+                os.remove(fpath)
+
+    if os.path.exists(index_dir / key):
+        shutil.rmtree(index_dir / key)
+
+
+def stale_stages(
+    metadata: dict,
+    index_dir: Path,
+    manifest: BuildManifest
+) -> list[str]:
+    """
+    The stages of a text whose inputs or params have changed since they were
+    built, together with every stage downstream of the first of them.
+    """
+    for e, (stage, fpath) in enumerate(stage_inputs(metadata, index_dir).items()):
+        if not os.path.exists(fpath) or manifest.get(metadata['key'], stage) != content_hash(stage, fpath):
+            return list(STAGES[e:])
+    return []
+
+
+def rebuild(
+    text_ids: list = None,
+    sources_dir: Path = params.SOURCES_DIR,
+    index_dir: Path = params.INDEX_DIR,
+    tool_dir: Path = params.TOOL_DIR,
+    workers: int = params.INDEX_WORKERS,
+    verbose: bool = True
+) -> list[str]:
+    """
+    Rebuilds only the stale stages of `text_ids` (by default every text with
+    metadata in `sources_dir`), patching them out of and back into the root,
+    then retrains the root model and matrices if anything changed. Texts
+    indexed before the manifest existed are adopted as they are. Returns the
+    keys of the texts that were rebuilt.
+    """
+    from aventine.library.files import perseus_xml2txt
+    from aventine.library.index import preprocess
+
+    sources_dir, index_dir = Path(sources_dir), Path(index_dir)
+    manifest = BuildManifest(index_dir)
+    metadata_dir = sources_dir / 'metadata'
+    rebuilt = []
+
+    if text_ids is None:
+        text_ids = sorted(i[:-len('.json')] for i in os.listdir(metadata_dir) if i.endswith('.json'))
+
+        # Texts whose sources are gone are taken out of the index
+        for key in sorted(set(manifest.entries) - set(text_ids) - {'root'}):
+            if verbose:
+                print(f'|- Removing `{key}`, which no longer has metadata.')
+            unindex_text(index_dir, key)
+            manifest.forget(key)
+            rebuilt.append(key)
+
+    for text_id in text_ids:
+        metadata = json_load(metadata_dir / f'{text_id}.json')
+        key = metadata['key']
+
+        if key not in manifest.entries and os.path.exists(index_dir / key / 'word2vec.model'):
+            if verbose:
+                print(f'|- Adopting `{key}` as built.')
+            manifest.record_text(metadata, index_dir)
+            continue
+
+        stages = stale_stages(metadata, index_dir, manifest)
+        if not stages:
+            continue
+        if verbose:
+            print(f'|- Rebuilding {", ".join(stages)} of `{key}`.')
+
+        if 'txt' in stages:
+            metadata = perseus_xml2txt(metadata, sources_dir, overwrite=True)
+        if 'lemmatised' in stages:
+            unindex_text(index_dir, key)
+            preprocess(metadata, index_dir, tool_dir=tool_dir, workers=workers)
+        elif 'word2vec' in stages:
+            if os.path.exists(index_dir / key / 'word2vec.model'):
+                os.remove(index_dir / key / 'word2vec.model')
+            preprocess(metadata, index_dir, tool_dir=tool_dir, workers=workers)
+
+        manifest.record_text(metadata, index_dir)
+        rebuilt.append(key)
+
+    if manifest.get('root', 'word2vec') != manifest.root_hash():
+        build_root(index_dir, verbose=verbose)
+        manifest.record_root()
+
+    return rebuilt
+
+
+def build_root(
+    index_dir: Path,
+    verbose: bool = True
+) -> None:
+    """Retrains the root word2vec model and rewrites everything derived from the root."""
+    from aventine.library.wordvec import train_word2vec_model, MultiCorpus, BinaryCorpus
+    from aventine.library.matrices import build_root_matrices
+    from aventine.library.ann import ann_dir, build_ann_indices
+
+    index_dir = Path(index_dir)
+    root_dir = index_dir / 'root'
+
+    if verbose:
+        print('|- Retraining the root word2vec model...')
+    corpus = MultiCorpus(index_dir)
+    if params.WORD2VEC_BINARY_CORPUS:
+        corpus = BinaryCorpus.write(corpus, root_dir / 'corpus')
+    train_word2vec_model(corpus).save(str(root_dir / 'word2vec.model'))
+
+    build_root_matrices(root_dir)
+    if any(os.path.exists(ann_dir(root_dir, name)) for name in params.ROOT_MATRICES):
+        build_ann_indices(root_dir, verbose=verbose)
@@ -0,0 +1,117 @@
+import os
+import threading
+import numpy as np
+from pathlib import Path
+
+from aventine.library.params import ROOT_FINGERPRINT, ROOT_MATRICES
+from aventine.library.utils import Checkpointer
+from aventine.library.utils import unit_rows
+
+
+def matrix_path(
+    root_dir: Path,
+    name: str
+) -> Path:
+    return Path(root_dir) / f'{name}.npy'
+
+
+def write_matrix(
+    matrix,
+    fpath: Path
+) -> None:
+    """
+    Writes `matrix` through a temporary file of this process and thread, then
+    moves it into place. The engine may rebuild stale matrices as it starts,
+    so several workers can be writing the same one at once; each rename is
+    atomic, and every writer writes the same contents.
+    """
+    _tmp_fpath = Path(fpath).with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        with open(_tmp_fpath, 'wb') as f:
+            np.save(f, matrix)
+        os.replace(_tmp_fpath, fpath)
+    finally:
+        if os.path.exists(_tmp_fpath):
+            os.remove(_tmp_fpath)
+
+def read_matrix(
+    fpath: Path
+):
+    # Matrices are only ever replaced whole (see `write_matrix`)
+    return np.load(fpath, mmap_mode='r')
+
+
+def build_root_matrices(
+    root_dir: Path
+) -> None:
+    """
+    Writes each embedding list in `ROOT_MATRICES` as a row-normalised float32
+    `.npy` matrix.
+    """
+    root_dir = Path(root_dir)
+    r = Checkpointer(root_dir, ROOT_FINGERPRINT).load()
+
+    for name in ROOT_MATRICES:
+        unit, _ = unit_rows(getattr(r, name))
+        write_matrix(unit, matrix_path(root_dir, name))
+
+
+def is_stale(
+    root_dir: Path,
+    name: str,
+    num_rows: int
+) -> bool:
+    matrix_fpath = matrix_path(root_dir, name)
+    source_fpath = Path(root_dir) / f'{name}.pkl'
+
+    if not os.path.exists(matrix_fpath):
+        return True
+    if os.path.exists(source_fpath) and \
+       os.path.getmtime(source_fpath) > os.path.getmtime(matrix_fpath):
+        return True
+    return read_matrix(matrix_fpath).shape[0] != num_rows
+
+
+def load_root_matrices(
+    root_dir: Path,
+    num_rows: int
+) -> dict[str, 'matrix']:
+    """
+    Memory-maps the row-normalised root matrices read-only, (re)building them
+    first if they are missing or older than the checkpoint they came from.
+    """
+    root_dir = Path(root_dir)
+    if any(is_stale(root_dir, name, num_rows) for name in ROOT_MATRICES):
+        build_root_matrices(root_dir)
+
+    return {
+        name: read_matrix(matrix_path(root_dir, name))
+        for name in ROOT_MATRICES
+    }
+
+
+def text_bitmap(
+    lemmata_arr: list,
+    root_lemmata_info: dict,
+    text_ids: list
+):
+    """
+    A lemma-by-text bitset, packed eight texts to a byte, whose row `i` marks
+    every text in which `lemmata_arr[i]` occurs.
+    """
+    columns = {text_id: j for j, text_id in enumerate(text_ids)}
+    bitmap = np.zeros((len(lemmata_arr), len(text_ids)), dtype=bool)
+    for i, lemma in enumerate(lemmata_arr):
+        for text_id in root_lemmata_info[lemma]['texts']:
+            if text_id in columns:
+                bitmap[i, columns[text_id]] = True
+    return np.packbits(bitmap, axis=1)
+
+def bitmap_mask(
+    bitmap,
+    text_ids: list,
+    texts: set
+):
+    """Rows of a packed `text_bitmap` that occur in any of `texts`."""
+    selected = np.packbits([text_id in texts for text_id in text_ids])
+    return (bitmap & selected).any(axis=1)
@@ -0,0 +1,234 @@
+import os
+import time
+import bisect
+import threading
+
+from aventine.library.params import METRICS, METRICS_BUCKETS
+
+
+class Histogram():
+    """
+    A Prometheus-style histogram of durations (or any other values) with
+    one optional label, e.g. the stage of a search. Thread-safe.
+    """
+    def __init__(self,
+                 name: str,
+                 help: str,
+                 label: str = None,
+                 buckets: tuple = METRICS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # label value: [count per bucket..., +Inf], sum
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, label: str = None):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def series(self) -> dict:
+        """`{label: (cumulative bucket counts, sum, count)}`."""
+        with self._lock:
+            items = [(label, list(counts), total) for label, (counts, total) in self._series.items()]
+        report = {}
+        for label, counts, total in items:
+            cumulative, n = [], 0
+            for count in counts:
+                n += count
+                cumulative.append(n)
+            report[label] = (cumulative, total, n)
+        return report
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+
+_registry = {}
+_gauges = {}
+_registry_lock = threading.Lock()
+_local = threading.local()
+
+
+def histogram(name: str, help: str, label: str = None, buckets: tuple = METRICS_BUCKETS) -> Histogram:
+    """The histogram called `name`, created on first use."""
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = Histogram(name, help, label, buckets)
+        return _registry[name]
+
+def gauge(name: str, help: str, read, label: str = None, type: str = 'gauge'):
+    """
+    Registers a gauge whose value is read when the metrics are rendered:
+    `read()` returns a number, or a `{label: number}` dict given a `label`.
+    """
+    with _registry_lock:
+        _gauges[name] = (help, read, label, type)
+
+def counter(name: str, help: str, read, label: str = None):
+    """`gauge`, for a value that only ever grows, such as the hits of a cache."""
+    gauge(name, help, read, label, type='counter')
+
+
+class _Timer():
+    __slots__ = ('hist', 'label', 'start')
+
+    def __init__(self, hist, label):
+        self.hist = hist
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.hist, self.label, time.perf_counter() - self.start)
+
+
+class Stopwatch():
+    """
+    Accumulates the time spent inside `with` blocks (or iterating `iter`),
+    and records it as one observation when `stop` is called. Used for a stage
+    that is interleaved with others, e.g. one step of a loop.
+    """
+    __slots__ = ('hist', 'label', 'elapsed', 'start')
+
+    def __init__(self, hist, label):
+        self.hist = hist
+        self.label = label
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed += time.perf_counter() - self.start
+
+    def iter(self, iterable):
+        it = iter(iterable)
+        while True:
+            self.start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.elapsed += time.perf_counter() - self.start
+                return
+            self.elapsed += time.perf_counter() - self.start
+            yield item
+
+    def stop(self):
+        record(self.hist, self.label, self.elapsed)
+
+
+class _Null():
+    """Stands in for timers and stopwatches while metrics are disabled."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def iter(self, iterable):
+        return iterable
+
+    def stop(self):
+        pass
+
+_null = _Null()
+
+
+def record(hist: Histogram, label: str, seconds: float):
+    hist.observe(seconds, label)
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        name = label or hist.name
+        timings[name] = timings.get(name, 0.0) + seconds
+
+def observe(hist: Histogram, value: float, label: str = None):
+    """`hist.observe`, unless metrics are disabled."""
+    if METRICS:
+        hist.observe(value, label)
+
+def timer(hist: Histogram, label: str = None):
+    """Times a `with` block into `hist`; free while metrics are disabled."""
+    return _Timer(hist, label) if METRICS else _null
+
+def stopwatch(hist: Histogram, label: str = None):
+    return Stopwatch(hist, label) if METRICS else _null
+
+
+def start_request():
+    """Collects the time of every stage recorded by this thread, for `Server-Timing`."""
+    _local.timings = {}
+
+def end_request() -> dict:
+    timings = getattr(_local, 'timings', None)
+    _local.timings = None
+    return timings or {}
+
+
+def _format_labels(hist_label, value, extra=''):
+    labels = []
+    if value is not None and hist_label is not None:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        labels.append(f'{hist_label}="{value}"')
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+def render() -> str:
+    """Every metric, in the Prometheus text exposition format."""
+    lines = []
+    with _registry_lock:
+        hists = list(_registry.values())
+        gauges = list(_gauges.items())
+
+    for hist in hists:
+        lines.append(f'# HELP {hist.name} {hist.help}')
+        lines.append(f'# TYPE {hist.name} histogram')
+        for value, (cumulative, total, n) in sorted(hist.series().items(), key=lambda i: str(i[0])):
+            for bound, count in zip(hist.buckets + (float('inf'),), cumulative):
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                bucket = _format_labels(hist.label, value, f'le="{le}"')
+                lines.append(f'{hist.name}_bucket{bucket} {count}')
+            lines.append(f'{hist.name}_sum{_format_labels(hist.label, value)} {total}')
+            lines.append(f'{hist.name}_count{_format_labels(hist.label, value)} {n}')
+
+    for name, (help, read, label, type) in gauges:
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {type}')
+        values = read()
+        if label is None:
+            lines.append(f'{name} {values}')
+        else:
+            for value, number in sorted(values.items()):
+                lines.append(f'{name}{_format_labels(label, value)} {number}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def summary(hist: Histogram) -> str:
+    """A line per label of `hist`: total and mean seconds, and count."""
+    lines = []
+    for value, (_, total, n) in sorted(hist.series().items(), key=lambda i: str(i[0])):
+        lines.append(f'|- {value or hist.name:<12s} {total:9.2f}s total '
+                     f'{total / n * 1000:9.2f}ms mean over {n}')
+    return '\n'.join(lines)
+
+
+def _after_fork():
+    global _registry_lock
+    _registry_lock = threading.Lock()
+    for hist in _registry.values():
+        hist.after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
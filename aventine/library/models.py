@@ -0,0 +1,57 @@
+import os
+import threading
+
+
+def load_lat_model():
+    from aventine.library.params_ml import WORD_EMBEDDING_MODEL as LAT_MODEL
+    return LAT_MODEL('lat')
+
+def load_eng_model():
+    from sentence_transformers import SentenceTransformer
+    from aventine.library.params_ml import SENTENCE_TRANSFORMER_MODEL as ENG_MODEL
+    return SentenceTransformer(ENG_MODEL, trust_remote_code=True)
+
+def load_cltk_nlp():
+    import cltk
+    from cltk import NLP
+    cltk_nlp = NLP(language="lat")
+    cltk_nlp.pipeline.processes = [
+        cltk.alphabet.processes.LatinNormalizeProcess,
+        cltk.dependency.processes.LatinStanzaProcess
+    ]
+    return cltk_nlp
+
+def load_lat_none():
+    import numpy as np
+    lat_model = get_model('lat_model')
+    return np.full_like(lat_model.get_word_vector('aventinus'), fill_value=1e-9)
+
+
+loaders = {
+    'lat_model': load_lat_model,
+    'eng_model': load_eng_model,
+    'cltk_nlp': load_cltk_nlp,
+    'lat_none': load_lat_none
+}
+
+_loaded = {}
+_lock = threading.RLock()
+
+def get_model(name: str, verbose: bool = False):
+    """The process-wide instance of model `name`, loaded on first use."""
+    if name not in _loaded:
+        with _lock:
+            if name not in _loaded:
+                if verbose:
+                    print(f'Instantiating `{name}` (takes a while)...')
+                _loaded[name] = loaders[name]()
+    return _loaded[name]
+
+
+def _after_fork():
+    # The lock may have been held by another thread at the time of fork
+    global _lock
+    _lock = threading.RLock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -1,10 +1,13 @@
 import os
+import sys
 import gdown
 import tarfile
 from pathlib import Path
 
 from aventine.library.params import INDEX_DATA_GID, QUICKSTART_DOCUMENTS
 from aventine.library.params import DATA_DIR, SOURCES_DIR, INDEX_DIR, TOOL_DIR
+from aventine.library.params import INDEX_WORKERS, WORD2VEC_BINARY_CORPUS
+from aventine.library.params import WORD2VEC_UPDATE_SAMPLE
 
 
 def download(
@@ -26,22 +29,202 @@ def download(
 def quickstart(
         sources_dir: Path = SOURCES_DIR,
         index_dir: Path = INDEX_DIR,
-        tool_dir: Path = TOOL_DIR
+        tool_dir: Path = TOOL_DIR,
+        workers: int = INDEX_WORKERS
     ):
     print('Beginning indexing of all sources in `config.QUICKSTART_DOCUMENTS`. This may take a while...\n')
 
-    from aventine.library.files import perseus_xml_get, perseus_xml2txt
+    from aventine.library.fetch import fetch_texts
+    from aventine.library.files import perseus_xml2txt
     from aventine.library.index import preprocess
-    from aventine.library.wordvec import train_word2vec_model, MultiCorpus
+    from aventine.library.manifest import BuildManifest
+    from aventine.library.wordvec import train_word2vec_model, MultiCorpus, BinaryCorpus
+    from aventine.library.matrices import build_root_matrices
+
+    fetched = fetch_texts(list(QUICKSTART_DOCUMENTS.values()), sources_dir,
+                          manifest_fpath=Path(sources_dir) / 'manifest.json')
+    missing = [doc for doc, text_id in QUICKSTART_DOCUMENTS.items() if text_id not in fetched]
+    if missing:
+        raise RuntimeError(f'Could not fetch {missing}; see {Path(sources_dir) / "manifest.json"}.')
 
     for doc in QUICKSTART_DOCUMENTS:
-        metadata = perseus_xml_get(QUICKSTART_DOCUMENTS[doc], sources_dir)
-        metadata = perseus_xml2txt(metadata, sources_dir)
-        preprocess(metadata, index_dir, tool_dir=tool_dir)
-        pass
+        metadata = perseus_xml2txt(fetched[QUICKSTART_DOCUMENTS[doc]], sources_dir)
+        preprocess(metadata, index_dir, tool_dir=tool_dir, workers=workers)
+        BuildManifest(index_dir).record_text(metadata, index_dir)
     
     print('\nGenerating overall word embeddings. This may take a while...')
-    model = train_word2vec_model(MultiCorpus(index_dir))
+    corpus = MultiCorpus(index_dir)
+    if WORD2VEC_BINARY_CORPUS:
+        corpus = BinaryCorpus.write(corpus, os.path.join(index_dir, 'root', 'corpus'))
+    model = train_word2vec_model(corpus)
     model.save(os.path.join(index_dir, 'root', 'word2vec.model'))
+    BuildManifest(index_dir).record_root()
+
+    print('\nWriting normalised embedding matrices...')
+    build_root_matrices(os.path.join(index_dir, 'root'))
+
+    print('\nIndexing complete!')
+
+
+def harvest(
+        sources_dir: Path = SOURCES_DIR
+    ):
+    print('Fetching every Latin text listed by Perseus. Rerun to resume or retry failures...')
+
+    from aventine.library.fetch import fetch_texts, CachedSession
+    from aventine.library.files import perseus_collect
+
+    manifest_fpath = Path(sources_dir) / 'manifest.json'
+    listing = perseus_collect(get=CachedSession().get)
+    fetched = fetch_texts(list(listing), sources_dir, manifest_fpath=manifest_fpath)
+    print(f'\n{len(fetched)} of {len(listing)} texts fetched; failures are listed in {manifest_fpath}.')
+
+
+def extend(
+        *text_ids: str,
+        sources_dir: Path = SOURCES_DIR,
+        index_dir: Path = INDEX_DIR,
+        tool_dir: Path = TOOL_DIR,
+        workers: int = INDEX_WORKERS,
+        sample: float = WORD2VEC_UPDATE_SAMPLE
+    ):
+    text_ids = text_ids or tuple(sys.argv[1:])
+    print(f'Adding {len(text_ids)} Perseus text(s) to the existing index...\n')
+
+    from gensim.models import Word2Vec
+    from aventine.library.fetch import fetch_texts
+    from aventine.library.files import perseus_xml2txt
+    from aventine.library.index import preprocess
+    from aventine.library.manifest import BuildManifest
+    from aventine.library.wordvec import update_word2vec_model, Corpus, MultiCorpus, ChainedCorpus
+    from aventine.library.matrices import build_root_matrices
+    from aventine.library.ann import ann_dir, build_ann_indices
+    from aventine.library.params import ROOT_MATRICES
+
+    fetched = fetch_texts(list(text_ids), sources_dir, manifest_fpath=Path(sources_dir) / 'manifest.json')
+    missing = [text_id for text_id in text_ids if text_id not in fetched]
+    if missing:
+        raise RuntimeError(f'Could not fetch {missing}; see {Path(sources_dir) / "manifest.json"}.')
+
+    keys = []
+    for text_id in text_ids:
+        metadata = perseus_xml2txt(fetched[text_id], sources_dir)
+        preprocess(metadata, index_dir, tool_dir=tool_dir, workers=workers)
+        BuildManifest(index_dir).record_text(metadata, index_dir)
+        keys.append(metadata['key'])
+
+    # An incremental update is not a full retrain, so the root stays marked
+    # stale in the build manifest until the next `aventine-rebuild`
+    print('\nUpdating overall word embeddings with the new texts...')
+    word2vec_fpath = os.path.join(index_dir, 'root', 'word2vec.model')
+    model = update_word2vec_model(
+        Word2Vec.load(word2vec_fpath),
+        ChainedCorpus(*(Corpus(os.path.join(index_dir, key, 'lemmatised.txt')) for key in keys)),
+        MultiCorpus(index_dir, exclude=keys),
+        sample=sample
+    )
+    model.save(word2vec_fpath)
+
+    print('\nWriting normalised embedding matrices...')
+    root_dir = Path(index_dir) / 'root'
+    build_root_matrices(root_dir)
+    # As in `manifest.build_root`, ANN indices are only kept up if they were built
+    if any(os.path.exists(ann_dir(root_dir, name)) for name in ROOT_MATRICES):
+        print('\nRebuilding approximate nearest-neighbour indices...')
+        build_ann_indices(root_dir)
 
     print('\nIndexing complete!')
+
+
+def rebuild(
+        sources_dir: Path = SOURCES_DIR,
+        index_dir: Path = INDEX_DIR,
+        tool_dir: Path = TOOL_DIR,
+        workers: int = INDEX_WORKERS
+    ):
+    print('Rebuilding whatever is stale in the index...')
+
+    from aventine.library.manifest import rebuild as rebuild_stale
+
+    text_ids = list(sys.argv[1:]) or None
+    rebuilt = rebuild_stale(text_ids, sources_dir, index_dir, tool_dir=tool_dir, workers=workers)
+    print(f'\nRebuilt {len(rebuilt)} text(s).' if rebuilt else '\nEverything is up to date.')
+
+
+def check_word2vec_update(
+        *held_out: str,
+        index_dir: Path = INDEX_DIR,
+        sample: float = WORD2VEC_UPDATE_SAMPLE,
+        seed: int = 0
+    ):
+    """
+    Trains a root model without the `held_out` texts, adds them back
+    incrementally, and compares the result with a model retrained on
+    everything. Runs single-threaded so that the numbers are reproducible.
+    """
+    held_out = held_out or tuple(sys.argv[1:])
+
+    from aventine.library.wordvec import train_word2vec_model, update_word2vec_model, compare_models
+    from aventine.library.wordvec import Corpus, MultiCorpus, ChainedCorpus
+
+    print('Training the baseline and full models. This may take a while...')
+    full = train_word2vec_model(MultiCorpus(index_dir), workers=1, seed=seed)
+    model = train_word2vec_model(MultiCorpus(index_dir, exclude=held_out), workers=1, seed=seed)
+
+    print('Updating the baseline with the held-out texts...')
+    model = update_word2vec_model(
+        model,
+        ChainedCorpus(*(Corpus(os.path.join(index_dir, key, 'lemmatised.txt')) for key in held_out)),
+        MultiCorpus(index_dir, exclude=held_out),
+        sample=sample,
+        seed=seed
+    )
+
+    report = compare_models(model, full, seed=seed)
+    for name, value in report.items():
+        print(f'|- {name}: {value}')
+    return report
+
+
+def build_ann(
+        index_dir: Path = INDEX_DIR,
+        k: int = 50
+    ):
+    print('Building approximate nearest-neighbour indices. This may take a while...')
+
+    from aventine.library.params import ROOT_MATRICES
+    from aventine.library.matrices import matrix_path, read_matrix
+    from aventine.library.ann import build_ann_indices, recall_at_k
+
+    root_dir = Path(index_dir) / 'root'
+    indices = build_ann_indices(root_dir)
+
+    for name in ROOT_MATRICES:
+        unit_vects = read_matrix(matrix_path(root_dir, name))
+        print(f'\nRecall@{k} of `{name}` ({indices[name].n_lists} lists):')
+        for row in recall_at_k(indices[name], unit_vects, k=k):
+            print(f"|- nprobe={row['nprobe']:<4d} recall={row['recall']:.3f} "
+                  f"latency={row['latency'] * 1000:.2f}ms "
+                  f"(exact {row['exact_latency'] * 1000:.2f}ms)")
+
+
+def benchmark_analysis(
+        text_fpath: Path = None,
+        num_chunks: int = 1000,
+        workers: int = INDEX_WORKERS
+    ):
+    if text_fpath is None:
+        if len(sys.argv) < 2:
+            sys.exit('Usage: aventine-bench-analysis <path to a .txt text>')
+        text_fpath = Path(sys.argv[1])
+    print(f'Lemmatising the first {num_chunks} chunks of {text_fpath}...')
+
+    from aventine.library.params import CHUNK_SEP
+    from aventine.library.index import analysis_throughput
+
+    with open(text_fpath, 'r', encoding='utf-8') as f:
+        chunks = f.read().split(CHUNK_SEP)[:num_chunks]
+
+    for row in analysis_throughput(chunks, workers=workers):
+        print(f"|- max_tokens={str(row['max_tokens']):<6s} "
+              f"{row['chunks_per_sec']:.1f} chunks/sec ({row['elapsed']:.1f}s)")
@@ -33,12 +33,72 @@ CORPUS_FINGERPRINT = {
     'lemmatised': str,
     'corpus_lemmata_info': dict
 }
+ROOT_MATRICES = ('lat_embeddings', 'eng_embeddings')
+
+CHECKPOINT_FLUSH_EVERY = 1          # indexed chunks per journal fsync
+CHECKPOINT_COMPACT_EVERY = 1000     # indexed chunks per full checkpoint
+JOURNAL_SEGMENT_BYTES = 64 * 2**20
+INDEX_WORKERS = 1           # lemmatisation processes, each with its own cltk pipeline
+INDEX_POOL_CHUNKSIZE = 4    # batches handed to a lemmatisation process at a time
+INDEX_BATCH_TOKENS = 1000   # words per lemmatisation call; None for one call per chunk
+DEFINITION_BATCH_SIZE = 256     # new definitions queued before encoding them together
+DEFINITION_CACHE_SIZE = 16384   # definition embeddings kept in memory, by hash of the text
+
+WWW_WORKERS = 4             # long-lived Whitaker's Words processes
+WWW_TIMEOUT = 30            # seconds to wait on Whitaker's Words before restarting it
+WWW_CACHE_FPATH = os.path.join(DATA_DIR, 'cache', 'definitions.jsonl')
 
 WORD2VEC_EPOCHS = 30
 WORD2VEC_DIMS = 300
+WORD2VEC_BINARY_CORPUS = True   # tokenise the corpus into integer ids once, before training
+WORD2VEC_UPDATE_SAMPLE = 0.1    # share of old sentences replayed when adding texts to the root model
+
+TOPK_BLOCK_FACTOR = 4   # candidates partitioned per block, as a multiple of `results`
+
+ANN_LISTS = None        # inverted lists per ANN index; None for sqrt(num_lemmata)
+ANN_ITERATIONS = 20
+ANN_TRAINING_SAMPLE = 100000
+ANN_NPROBE = None       # lists probed per query; None for exact search
+
+SCOPE_CACHE_SIZE = 8    # per-text word2vec models kept in memory for scoped search
+QUERY_CACHE_SIZE = 4096 # query encodings and lemmatisations kept in memory
+QUERY_CACHE_FPATH = None    # e.g. os.path.join(DATA_DIR, 'cache', 'queries.pkl')
+RESULT_CACHE_SIZE = 1024    # whole search results kept in memory by each worker
+RESULT_CACHE_DIR = None     # e.g. os.path.join(DATA_DIR, 'cache', 'results'), shared by workers
+RESULT_CACHE_DIR_SIZE = 100000  # results kept in RESULT_CACHE_DIR, the least recently used evicted
+
+CITATIONS_PER_TEXT = 20     # citation links shown per text in each search result
+CITATIONS_PAGE_SIZE = 500   # citation links per page when listing them in full
+
+SNAPSHOT = True         # keep a consolidated snapshot of the loaded index in `root/`
+SNAPSHOT_FORMAT = 1
+
+METRICS = True              # per-stage timings, served at `/metrics`; False makes every timer a no-op
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SERVER_TIMING = False       # add a `Server-Timing` header with the stages of each request
+
+SEARCH_BATCH_WAIT = 0.005   # seconds concurrent queries are gathered for; 0 to search one at a time
+SEARCH_BATCH_SIZE = 16      # queries searched together at most
+
+API_PAGE_SIZE = 20          # results (or citations) per page of the JSON API
+API_MAX_RESULTS = 500       # deepest result the JSON API pages through
+API_MAX_BATCH = 32          # queries per batch request
+API_CITATIONS = 5           # citation links per text inlined in each API result
+API_MAX_AGE = 300           # seconds clients and proxies may cache API responses
+API_GZIP_MIN_BYTES = 1024
+
+PRELOAD_MODELS = ('eng', 'lat')     # models loaded before gunicorn forks its workers
+WORKER_TORCH_THREADS = None         # None to split the CPUs between $WEB_CONCURRENCY workers
 
 ###############################
 
+FETCH_WORKERS = 8           # concurrent requests to Perseus
+FETCH_RETRIES = 5
+FETCH_BACKOFF = 0.5         # seconds, doubled on every retry
+FETCH_TIMEOUT = 60
+HTTP_CACHE_DIR = os.path.join(DATA_DIR, 'cache', 'http')
+FETCH_MANIFEST_FPATH = os.path.join(SOURCES_DIR, 'manifest.json')
+
 INDEX_DATA_GID = '1M-lNKVDhXH0j24CQW2FEW_cD4XHRNKx-'
 
 QUICKSTART_DOCUMENTS = {
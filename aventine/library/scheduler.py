@@ -0,0 +1,143 @@
+import os
+import weakref
+import warnings
+import threading
+from collections import Counter
+from typing import Dict, Union
+
+from aventine.library.params import SEARCH_BATCH_WAIT, SEARCH_BATCH_SIZE
+from aventine.library import metrics
+
+
+_batch_sizes = metrics.histogram('aventine_search_batch_size', 'Queries searched together in each batch.',
+                                 buckets=(1, 2, 4, 8, 16, 32, 64))
+_batch_waits = metrics.histogram('aventine_search_batch_wait_seconds',
+                                 'Time spent gathering each batch before searching it.')
+
+
+class _Batch():
+    def __init__(self):
+        self.queries = []
+        self.results = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class BatchScheduler():
+    """
+    Sits in front of an `AventineSearch` and gathers the queries that arrive
+    together into one `search_batch` call, so that they share a batched
+    encode and a single matrix-matrix similarity pass. Queries are grouped by
+    everything but the query itself; the first one in a group waits up to
+    `max_wait` seconds (or until `max_batch` have joined it) if any other
+    search is in flight, runs the batch on its own thread and hands every
+    caller its own result. Cached results are returned without queueing. No
+    threads are started, so it is safe to fork.
+    """
+    def __init__(self,
+                 engine,
+                 max_wait: float = SEARCH_BATCH_WAIT,
+                 max_batch: int = SEARCH_BATCH_SIZE):
+        self.engine = engine
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        self.queued = 0
+        self.max_queued = 0
+        self.batches = 0
+        self.batch_sizes = Counter()
+
+        metrics.gauge('aventine_search_queued', 'Queries waiting for or in a batch search.',
+                      lambda: self.queued)
+        _schedulers.add(self)
+
+    def after_fork(self):
+        # Batches being gathered belong to the parent's threads
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.queued = 0
+
+    def search(
+        self,
+        query: str,
+        language: Union["eng", "lat"],
+        texts: list = None,
+        results: int = 50,
+        scope: Union["universal", "root", str] = "universal"
+    ) -> Dict:
+        """`AventineSearch.search`, batched with whatever else is in flight."""
+        if not self.max_wait or self.max_batch <= 1:
+            return self.engine.search(query, language, texts, results, scope)
+
+        # Cached results need no batch to wait for
+        try:
+            data = self.engine.cached_result(self.engine.result_key(query, language, texts, results, scope))
+        except Exception:
+            data = None
+        if data is not None:
+            return data
+
+        key = (language, None if texts is None else frozenset(texts), results, scope)
+        with self._lock:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._pending[key] = _Batch()
+            i = len(batch.queries)
+            batch.queries.append(query)
+            if len(batch.queries) >= self.max_batch:
+                del self._pending[key]
+                batch.full.set()
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+            # Alone (e.g. under sync workers), there is nobody to wait for
+            wait = self.queued > 1
+
+        if leader:
+            if wait:
+                with metrics.timer(_batch_waits):
+                    batch.full.wait(self.max_wait)
+            with self._lock:
+                if self._pending.get(key) is batch:
+                    del self._pending[key]
+            self._run(batch, language, texts, results, scope)
+        else:
+            batch.done.wait()
+        return batch.results[i]
+
+    def _run(self, batch, language, texts, results, scope):
+        try:
+            batch.results = self.engine.search_batch(batch.queries, language, texts, results, scope)
+        except Exception as e:
+            warnings.warn(f'Batch of {len(batch.queries)} queries failed: {e}')
+            batch.results = [None for _ in batch.queries]
+        finally:
+            with self._lock:
+                self.queued -= len(batch.queries)
+                self.batches += 1
+                self.batch_sizes[len(batch.queries)] += 1
+            metrics.observe(_batch_sizes, len(batch.queries))
+            batch.done.set()
+
+    def stats(self):
+        queries = sum(size * n for size, n in self.batch_sizes.items())
+        return {
+            'queued': self.queued,
+            'max_queued': self.max_queued,
+            'batches': self.batches,
+            'queries': queries,
+            'mean_batch_size': queries / self.batches if self.batches else 0,
+            'batch_sizes': dict(sorted(self.batch_sizes.items()))
+        }
+
+
+_schedulers = weakref.WeakSet()
+
+def _after_fork():
+    for scheduler in list(_schedulers):
+        scheduler.after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -1,31 +1,45 @@
 import logging
-print('Importing libraries. This may take a while (~1 minute)...')
-
 import os
 import re
+import sys
 import json
+import atexit
+import hashlib
 import warnings
+import weakref
 import numpy as np
 from pathlib import Path
+from itertools import takewhile
 from typing import Union, List, Dict, Any, Tuple
 
-import cltk
-from cltk import NLP
-from gensim.models import Word2Vec
-from sentence_transformers import SentenceTransformer
-
 from aventine.library.params import MODE
-from aventine.library.params import ROOT_FINGERPRINT, CORPUS_FINGERPRINT
+from aventine.library.params import ROOT_FINGERPRINT, CORPUS_FINGERPRINT, ROOT_MATRICES
 from aventine.library.params import ALLOWED_SYMBOLS, ALLOWED_PUNCTS
 from aventine.library.params import ALLOWED_LEMMATA, BAD_LEMMATA
-from aventine.library.params_ml import SENTENCE_TRANSFORMER_MODEL as ENG_MODEL
-from aventine.library.params_ml import WORD_EMBEDDING_MODEL as LAT_MODEL
+from aventine.library.params import TOPK_BLOCK_FACTOR, ANN_NPROBE
+from aventine.library.params import SCOPE_CACHE_SIZE
+from aventine.library.params import QUERY_CACHE_SIZE, QUERY_CACHE_FPATH
+from aventine.library.params import RESULT_CACHE_SIZE, RESULT_CACHE_DIR, RESULT_CACHE_DIR_SIZE
+from aventine.library.params import CITATIONS_PER_TEXT
+from aventine.library.params import SNAPSHOT, SNAPSHOT_FORMAT
+from aventine.library.params import WORKER_TORCH_THREADS
 from aventine.library.utils import Checkpointer
 from aventine.library.utils import meanings
 from aventine.library.utils import normalise_text
-from aventine.library.files import perseus_url
-from aventine.library.utils import get_null
+from aventine.library.files import perseus_urls
 from aventine.library.utils import clock_title
+from aventine.library.utils import unit_rows
+from aventine.library.utils import LRUCache, FileCache
+from aventine.library.utils import pickle_dump, pickle_load
+from aventine.library.matrices import load_root_matrices
+from aventine.library.matrices import text_bitmap, bitmap_mask
+from aventine.library.ann import load_ann_indices
+from aventine.library.models import get_model
+from aventine.library import metrics
+
+
+_stages = metrics.histogram('aventine_search_stage_seconds',
+                            'Time spent in each stage of a search.', label='stage')
 
 
 def get_metadata(
@@ -39,24 +53,85 @@ def get_metadata(
     ) as f:
         return json.load(f)
 
-def get_similarities(a, vects):
-    sims = vects @ a.transpose()
-    norm_a = np.linalg.norm(a)
-    norm_v = np.linalg.norm(vects, axis=1)
-    revalued = sims / (2 * norm_a * norm_v) + 0.5
+def index_version(
+    index_dir: Path,
+    metadata_dir: Path,
+    text_ids: list
+) -> str:
+    """
+    Digest of the name, size and modification time of every file the engine
+    loads, which changes whenever the index is rebuilt or extended.
+    """
+    digest = hashlib.sha1()
+    fpaths = [Path(index_dir)/'root'/i for i in sorted(os.listdir(Path(index_dir)/'root'))]
+    for text_id in sorted(text_ids):
+        fpaths.extend(Path(index_dir)/text_id/i for i in sorted(os.listdir(Path(index_dir)/text_id)))
+        fpaths.append(Path(metadata_dir)/f'{text_id}.json')
+
+    for fpath in fpaths:
+        # Skip whatever the engine derives from the index itself
+        if fpath.name == 'snapshot.pkl' or fpath.suffix in {'.npy', '.tmp'} or \
+           not os.path.isfile(fpath):
+            continue
+        stat = os.stat(fpath)
+        digest.update(f'{fpath}:{stat.st_size}:{stat.st_mtime_ns};'.encode('utf-8'))
+    return digest.hexdigest()
+
+def get_similarities(a, unit_vects):
+    """
+    Cosine similarities of `a` against the rows of `unit_vects`, rescaled into
+    [0, 1]. The rows must already be normalised (see `utils.unit_rows`). For a
+    matrix of queries `a`, column `j` holds the similarities of `a[j]`.
+    """
+    sims = unit_vects @ a.transpose()
+    norm_a = np.linalg.norm(a, axis=-1)
+    revalued = sims / (2 * norm_a) + 0.5
     return revalued
 
 def argmaxk(arr, k):
     return np.flip(np.argsort(arr)[-k:])
 
-def atomise(cltk_nlp, query):
+def ranked_indices(arr, block):
+    """
+    Yields the indices of `arr` in descending order of value, equivalent to
+    walking `np.flip(np.argsort(arr, kind='stable'))`. Only blocks of (at
+    least) `block` candidates are partitioned out and sorted at a time, and
+    the block size doubles whenever the caller asks for more.
+    """
+    arr = np.where(np.isnan(arr), -np.inf, arr)
+    remaining = np.arange(len(arr))
+    block = max(int(block), 1)
+
+    while len(remaining) > 0:
+        vals = arr[remaining]
+        if block < len(remaining):
+            kth = len(remaining) - block
+            threshold = vals[np.argpartition(vals, kth)[kth:]].min()
+            # Take every tie of the threshold so the order is exact
+            taken = vals >= threshold
+        else:
+            taken = np.ones(len(remaining), dtype=bool)
+
+        candidates = remaining[taken]
+        order = np.lexsort((candidates, arr[candidates]))
+        yield from candidates[order[::-1]]
+
+        remaining = remaining[~taken]
+        block *= 2
+
+def clean_query(query):
     query = re.sub(ALLOWED_PUNCTS, '', query)
-    query = normalise_text(query, ALLOWED_SYMBOLS, ALLOWED_PUNCTS)
-    doc = cltk_nlp(text=query)
+    return normalise_text(query, ALLOWED_SYMBOLS, ALLOWED_PUNCTS)
+
+def lemmatise(cltk_nlp, cleaned_query):
+    doc = cltk_nlp(text=cleaned_query)
     atoms = [w.strip() for w in doc.lemmata
              if re.fullmatch(ALLOWED_LEMMATA, w) and w not in BAD_LEMMATA]
     return atoms
 
+def atomise(cltk_nlp, query):
+    return lemmatise(cltk_nlp, clean_query(query))
+
 
 class Word2VecWrapper():
     def __init__(self, model):
@@ -69,6 +144,26 @@ class Word2VecWrapper():
             return None
 
 
+class ScopedVectors():
+    """
+    The vocabulary of a per-text word2vec model, with its vectors stacked
+    into a row-normalised matrix aligned with `lemmata`.
+    """
+    def __init__(self, fpath, lemma2row):
+        from gensim.models import Word2Vec
+        self.wv = Word2Vec.load(str(fpath)).wv
+        self.lemmata = np.array(self.wv.index_to_key)
+        self.unit_vects, _ = unit_rows(self.wv.vectors)
+        # Row of each lemma in the root index, or -1
+        self.rows = np.array([lemma2row.get(k, -1) for k in self.wv.index_to_key])
+
+    def get_word_vector(self, word):
+        try:
+            return self.wv[word]
+        except KeyError:
+            return None
+
+
 class AventineSearch():
     @clock_title('Aventine search engine initialisation')
     def __init__(
@@ -90,46 +185,330 @@ class AventineSearch():
         self.tool_dir = Path(tool_dir)
         self.metadata_dir = self.sources_dir / 'metadata'
 
-        vprint('Loading indexed data. This may take a while (~2 minutes)...')
-        vprint('|- Loading metadata...')
+        vprint('Loading indexed data...')
         self.all_docs = [i for i in os.listdir(self.index_dir) if i != 'root']
-        self.text_metas = {
+        self.index_version = index_version(self.index_dir, self.metadata_dir, self.all_docs)
+        self.snapshot_fpath = self.index_dir / 'root' / 'snapshot.pkl'
+
+        state = self.load_snapshot() if SNAPSHOT else None
+        if state is None:
+            state = self._load_index(vprint)
+            if SNAPSHOT:
+                vprint('|- Writing index snapshot...')
+                self.save_snapshot(state)
+        for name, value in state.items():
+            setattr(self, name, value)
+
+        vprint('|- Mapping embedding matrices...')
+        matrices = load_root_matrices(self.index_dir/'root', len(self.r.lemmata_arr))
+        self.root_lat_embeddings = matrices['lat_embeddings']
+        self.root_eng_embeddings = matrices['eng_embeddings']
+
+        self.nprobe = ANN_NPROBE
+        self.ann = {}
+        if self.nprobe is not None:
+            vprint('|- Mapping ANN indices...')
+            self.ann = load_ann_indices(self.index_dir/'root', len(self.r.lemmata_arr))
+
+        self.scope_cache = LRUCache(SCOPE_CACHE_SIZE)
+        self.query_cache = LRUCache(QUERY_CACHE_SIZE)
+        self.query_cache_fpath = QUERY_CACHE_FPATH
+        if self.query_cache_fpath is not None:
+            if os.path.exists(self.query_cache_fpath):
+                try:
+                    self.query_cache.update(pickle_load(Path(self.query_cache_fpath)))
+                except Exception as e:
+                    warnings.warn(f'Could not read the query cache ({e}); starting with an empty one.')
+
+        # Whole results, in memory and optionally on disk for every worker;
+        # keyed on the index version, so a rebuilt index never hits old ones
+        self.result_cache = LRUCache(RESULT_CACHE_SIZE)
+        self.result_store = None
+        if RESULT_CACHE_DIR is not None:
+            self.result_store = FileCache(RESULT_CACHE_DIR, self.index_version, RESULT_CACHE_DIR_SIZE)
+
+        metrics.gauge('aventine_cache_entries', 'Entries in each cache of the engine.',
+                      lambda: {name: s['size'] for name, s in self.cache_stats().items()}, label='cache')
+        metrics.counter('aventine_cache_hits_total', 'Lookups answered by each cache of the engine.',
+                        lambda: {name: s['hits'] for name, s in self.cache_stats().items()}, label='cache')
+        metrics.counter('aventine_cache_misses_total', 'Lookups missed by each cache of the engine.',
+                        lambda: {name: s['misses'] for name, s in self.cache_stats().items()}, label='cache')
+
+        vprint('|- Creating quick access aliases...')
+        self.root_lemmata_arr = np.asarray(self.r.lemmata_arr)
+        self.root_definitions = np.asarray(self.r.definitions)
+        self.lemma2row = {lemma: i for i, lemma in enumerate(self.r.lemmata_arr)}
+
+        _engines.add(self)
+
+        vprint('\n[ENGINE READY]')
+    
+    def _load_index(self, vprint):
+        vprint('|- Loading metadata...')
+        text_metas = {
             text_id: get_metadata(self.metadata_dir, text_id)
             for text_id in self.all_docs
         }
-        self.id2title = {
-            text_id: get_metadata(self.metadata_dir, text_id)['title']
+        id2title = {
+            text_id: text_metas[text_id]['title']
             for text_id in sorted(self.all_docs)
         }
-        
+        text_urls = {
+            text_id: perseus_urls(text_metas[text_id])
+            for text_id in self.all_docs
+        }
+
         vprint('|- Loading checkpoints...')
         root_ckpt = Checkpointer(self.index_dir/'root', ROOT_FINGERPRINT)
-        self.r = root_ckpt.load()
-        self.text_ckpts = {
-            text_id: Checkpointer(self.index_dir/text_id, CORPUS_FINGERPRINT).load()
+        r = root_ckpt.load(skip=ROOT_MATRICES)
+        text_ckpts = {
+            text_id: Checkpointer(self.index_dir/text_id, CORPUS_FINGERPRINT).load(skip={'lemmatised'})
             for text_id in self.all_docs
         }
 
-        vprint('|- Creating quick access aliases...')
-        self.root_lat_embeddings = np.array(self.r.lat_embeddings, copy=False)
-        self.root_eng_embeddings = np.array(self.r.eng_embeddings, copy=False)
-        self.root_lemmata_arr = np.array(self.r.lemmata_arr, copy=False)
-        self.root_definitions = np.array(self.r.definitions, copy=False)
-        
-        vprint('|- Instantiating embedding models (takes a while)...')
-        self.lat_model =  LAT_MODEL('lat')
-        self.eng_model = SentenceTransformer(ENG_MODEL, trust_remote_code=True)
-        self.lat_none, _ = get_null(self.lat_model, self.eng_model)
-
-        vprint('|- Instantiating cltk pipelines...')
-        self.cltk_nlp = NLP(language="lat")
-        self.cltk_nlp.pipeline.processes = [
-            cltk.alphabet.processes.LatinNormalizeProcess,
-            cltk.dependency.processes.LatinStanzaProcess
-        ]
+        vprint('|- Building lemma-text bitmap...')
+        text_ids = sorted(self.all_docs)
+
+        return {
+            'text_metas': text_metas,
+            'id2title': id2title,
+            'text_urls': text_urls,
+            'r': r,
+            'text_ckpts': text_ckpts,
+            'text_ids': text_ids,
+            'text_bitmap': text_bitmap(r.lemmata_arr, r.root_lemmata_info, text_ids)
+        }
+
+    def load_snapshot(self):
+        """
+        The state saved by `save_snapshot`, or `None` if there is none or it
+        was written for another format or version of the index.
+        """
+        if not os.path.exists(self.snapshot_fpath):
+            return None
+        try:
+            snapshot = pickle_load(self.snapshot_fpath)
+        except Exception as e:
+            warnings.warn(f'Could not read index snapshot ({e}); loading checkpoints instead.')
+            return None
+        if snapshot.get('format') != SNAPSHOT_FORMAT or \
+           snapshot.get('index_version') != self.index_version:
+            return None
+        if self.verbose:
+            print('|- Loaded index snapshot.')
+        return snapshot['state']
+
+    def save_snapshot(self, state):
+        try:
+            pickle_dump({
+                'format': SNAPSHOT_FORMAT,
+                'index_version': self.index_version,
+                'state': state
+            }, self.snapshot_fpath)
+        except OSError as e:
+            warnings.warn(f'Could not write index snapshot ({e}).')
+
+    # Models are shared by every engine in the process (see `models.get_model`),
+    # and loaded on first use of their language (see `warmup`)
+    @property
+    def lat_model(self):
+        return get_model('lat_model', self.verbose)
+
+    @property
+    def eng_model(self):
+        return get_model('eng_model', self.verbose)
+
+    @property
+    def cltk_nlp(self):
+        return get_model('cltk_nlp', self.verbose)
+
+    @property
+    def lat_none(self):
+        return get_model('lat_none', self.verbose)
+
+    def warmup(self, languages=('eng', 'lat')):
+        """Loads the models of `languages` now rather than on first use."""
+        if 'eng' in languages:
+            self.eng_model
+        if 'lat' in languages:
+            self.lat_model
+            self.cltk_nlp
+
+    def after_fork(self):
+        """Sets up the per-worker mutable state of a freshly forked process."""
+        self.scope_cache.after_fork()
+        self.query_cache.after_fork()
+        self.result_cache.after_fork()
+
+    def encode(self, query):
+        """`eng_model.encode`, memoised on the whitespace-normalised query."""
+        key = ' '.join(query.split())
+        return self.query_cache.get_or_create(
+            ('eng', key), lambda: self.eng_model.encode(key)
+        )
+
+    def atomise(self, query):
+        """`atomise`, memoised on the cleaned query."""
+        key = clean_query(query)
+        return self.query_cache.get_or_create(
+            ('lat', key), lambda: lemmatise(self.cltk_nlp, key)
+        )
+
+    def _ranked(self, a, unit_vects, results, ann=None, mask=None):
+        """
+        Yields `(index, score)` pairs in descending order of similarity to `a`,
+        among the rows allowed by `mask` (or all rows). With an ANN index, only
+        the `self.nprobe` closest lists are scored at first; should they run
+        out, the remaining rows are scanned exactly.
+        """
+        block = TOPK_BLOCK_FACTOR * results
+
+        if ann is None or self.nprobe is None:
+            yield from self._ranked_rows(a, unit_vects, block, mask=mask)
+            return
+
+        with metrics.timer(_stages, 'ann_probe'):
+            candidates = ann.probe(a, self.nprobe)
+        if mask is not None:
+            candidates = candidates[mask[candidates]]
+        yield from self._ranked_rows(a, unit_vects, block, rows=candidates)
+
+        rest = np.ones(len(unit_vects), dtype=bool) if mask is None else mask.copy()
+        rest[candidates] = False
+        yield from self._ranked_rows(a, unit_vects, block, mask=rest)
+
+    def _ranked_rows(self, a, unit_vects, block, rows=None, mask=None):
+        """
+        `_ranked` over the given `rows` of `unit_vects`, or over every row
+        allowed by `mask`. Masked rows are scored along with the rest and then
+        ranked last, which is cheaper than copying the others out of the
+        (memory-mapped) matrix, and the ranking stops when it reaches them.
+        """
+        with metrics.timer(_stages, 'similarity'):
+            sims = get_similarities(a, unit_vects if rows is None else unit_vects[rows])
+            if mask is not None:
+                sims[~mask] = -np.inf
+
+        # Only the candidates pulled by `_collect` are ever ranked
+        topk = metrics.stopwatch(_stages, 'topk')
+        try:
+            for idx in topk.iter(ranked_indices(sims, block)):
+                if mask is not None and not mask[idx]:
+                    return
+                yield (idx if rows is None else rows[idx]), sims[idx]
+        finally:
+            topk.stop()
+
+    def _mask(self, texts, rows=None):
+        """
+        Rows of a vocabulary occurring in any of `texts`, or `None` if there is
+        nothing to filter. `rows` maps a scoped vocabulary onto root rows.
+        """
+        if len(texts) == 0:
+            return None
+        mask = bitmap_mask(self.text_bitmap, self.text_ids, texts)
+        if rows is not None:
+            mask = np.where(rows >= 0, mask[rows], False)
+        return None if mask.all() else mask
+
+    def _space(self, language, scope):
+        """
+        The lemmata, their normalised vectors, ANN index, Latin embedder and,
+        for scoped vocabularies, the root row of each lemma.
+        """
+        if language == 'eng':
+            return (self.root_lemmata_arr, self.root_eng_embeddings,
+                    self.ann.get('eng_embeddings'), None, None)
+
+        if scope == 'universal':
+            return (self.root_lemmata_arr, self.root_lat_embeddings,
+                    self.ann.get('lat_embeddings'), self.lat_model, None)
+
+        embedder = self.scope_cache.get_or_create(
+            scope, lambda: ScopedVectors(self.index_dir/scope/'word2vec.model', self.lemma2row)
+        )
+        return embedder.lemmata, embedder.unit_vects, None, embedder, embedder.rows
+
+    def _sense(self, atoms, embedder):
+        senses = []
+        for w in atoms:
+            arr = embedder.get_word_vector(w)
+            if arr is not None:
+                senses.append(arr)
+        if len(senses) == 0:
+            warnings.warn("No valid lemmata found in the query.")
+            return None
+        return np.mean(senses, axis=0)
+
+    def _collect(self, ranked, lemmata, rows, language, repeated, texts, results):
+        # Given arbitrary arrays `lemma` and the `ranked` (index, score) pairs
+        found = 0
+        data = []
+        links = metrics.stopwatch(_stages, 'links')
+
+        for lemma_idx, score in ranked:
+            if found >= results:
+                break
+
+            lemma = lemmata[lemma_idx]
+            root_idx = lemma_idx if rows is None else rows[lemma_idx]
+            if lemma in self.r.existing_lemmata:
+                meaning = self.root_definitions[root_idx]
+            else:
+                meaning = '' # @change meanings(lemma, tool_dir=self.tool_dir)
+
+            if (language == 'eng' and meaning in repeated) or \
+               (language == 'lat' and lemma in repeated):
+                continue
+
+            if len(texts) == 0:
+                data.append({
+                    'score': float(score),
+                    'lemma': lemma,
+                    'definition': meaning,
+                    'texts': [],
+                    'links': {},
+                    'counts': {}
+                })
+                found += 1
+
+            elif lemma in self.r.existing_lemmata:
+                with links:
+                    intersect = self.r.root_lemmata_info[lemma]['texts'].intersection(texts)
+                    if intersect:
+                        data.append({
+                            'score': float(score),
+                            'lemma': lemma,
+                            'definition': meaning,
+                            'texts': list(intersect),
+                            'links': {
+                                text_id: self.citations(lemma, text_id, limit=CITATIONS_PER_TEXT)
+                                for text_id in intersect
+                            },
+                            'counts': {
+                                text_id: self.num_citations(lemma, text_id)
+                                for text_id in intersect
+                            }
+                        })
+                        found += 1
+
+        links.stop()
+        return data
+
+    def num_citations(self, lemma, text_id):
+        return len(self.text_ckpts[text_id].corpus_lemmata_info[lemma]['loc'])
+
+    def citations(self, lemma, text_id, offset=0, limit=None):
+        """
+        `(url, citation)` pairs for the occurrences of `lemma` in `text_id`,
+        from the `offset`-th occurrence onwards (at most `limit` of them).
+        """
+        quotes = self.text_ckpts[text_id].corpus_lemmata_info[lemma]['loc']
+        quotes = quotes[offset:] if limit is None else quotes[offset:offset + limit]
+        index = self.text_metas[text_id]['index']
+        urls = self.text_urls[text_id]
+        return [(urls[quote_id], index[quote_id]) for quote_id in quotes]
 
-        vprint('\n[ENGINE READY]')
-    
     def _search(
         self,
         query: str,
@@ -147,97 +526,199 @@ class AventineSearch():
             texts = self.all_docs
         
         texts = set(texts)
+        lemmata, vects, ann, embedder, rows = self._space(language, scope)
         
         if language == 'eng':
-            sent = self.eng_model.encode(query)
-            sims = get_similarities(sent, self.root_eng_embeddings)
-            lemmata = self.root_lemmata_arr
+            with metrics.timer(_stages, 'encode'):
+                sent = self.encode(query)
             repeated = set([query])
         
         elif language == 'lat':
-            if scope == 'universal':
-                embedder = self.lat_model
-                lemmata = self.root_lemmata_arr
-                vects = self.root_lat_embeddings
-            else:
-                wv_model = Word2Vec.load(str(self.index_dir/scope/'word2vec.model'))
-                embedder = Word2VecWrapper(wv_model)
-                lemmata, vects = [], []
-                for k in wv_model.wv.key_to_index:
-                    lemmata.append(k)
-                    vects.append(wv_model.wv[k])
-                lemmata, vects = np.array(lemmata, copy=False), np.array(vects, copy=False)
-            
-            senses = []
-            atoms = atomise(self.cltk_nlp, query)
+            with metrics.timer(_stages, 'atomise'):
+                atoms = self.atomise(query)
             repeated = set(atoms)
-            for w in atoms:
-                arr = embedder.get_word_vector(w)
-                if arr is not None:
-                    senses.append(arr)
-            if len(senses) == 0:
-                warnings.warn("No valid lemmata found in the query.")
+            with metrics.timer(_stages, 'sense'):
+                sent = self._sense(atoms, embedder)
+            if sent is None:
                 return None
-            
-            sent = np.mean(senses, axis=0)
-            sims = get_similarities(sent, vects)
 
-        # Given arbitrary arrays `lemma` and `sims`
-        idx = 0
-        found = 0
-        data = []
-        sorted = np.flip(np.argsort(sims))
-        
-        while found < results and idx < len(sorted):
-            lemma_idx = sorted[idx]
-            lemma = lemmata[lemma_idx]
-            if lemma in self.r.existing_lemmata:
-                meaning = self.root_definitions[lemma_idx]
-            else:
-                meaning = '' # @change meanings(lemma, tool_dir=self.tool_dir)
+        with metrics.timer(_stages, 'text_filter'):
+            mask = self._mask(texts, rows)
+        ranked = self._ranked(sent, vects, results, ann, mask)
+        return self._collect(ranked, lemmata, rows, language, repeated, texts, results)
 
-            if (language == 'eng' and meaning in repeated) or \
-               (language == 'lat' and lemma in repeated):
-                idx += 1
-                continue
+    def _search_batch(
+        self,
+        queries: List[str],
+        language: Union["eng", "lat"],
+        texts: list = None,
+        results: int = 50,
+        scope: Union["universal", "root", str] = "universal"
+    ) -> List[Dict]:
+        """
+        Runs `_search` over many queries at once: uncached English queries are
+        encoded in a single batch, and every query is scored against the
+        lemmata with one matrix-matrix product (or, with an ANN index, against
+        the lists it probes). Invalid queries yield `None`.
+        """
 
-            if len(texts) == 0:
-                data.append({
-                    'score': float(sims[lemma_idx]),
-                    'lemma': lemma,
-                    'definition': meaning,
-                    'texts': [],
-                    'links': {}
-                })
-                idx += 1
-                found += 1
+        if language not in {'eng', 'lat'}:
+            warnings.warn("Invalid query or language.")
+            return [None for _ in queries]
 
-            elif lemma in self.r.existing_lemmata:
-                intersect = self.r.root_lemmata_info[lemma]['texts'].intersection(texts)
-                if intersect:
-                    urls = {}
-                    for text_id in intersect:
-                        quotes = self.text_ckpts[text_id].corpus_lemmata_info[lemma]['loc']
-                        urls[text_id] = [(perseus_url(self.text_metas[text_id],
-                                                      self.text_metas[text_id]['index'][quote_id]),
-                                          self.text_metas[text_id]['index'][quote_id])
-                                         for quote_id in quotes]
-                    data.append({
-                        'score': float(sims[lemma_idx]),
-                        'lemma': lemma,
-                        'definition': self.root_definitions[lemma_idx],
-                        'texts': list(intersect),
-                        'links': urls
-                    })
-                    found += 1
-            
-            idx += 1
+        if texts is None:
+            texts = self.all_docs
 
-        return data
+        texts = set(texts)
+        lemmata, vects, ann, embedder, rows = self._space(language, scope)
+        with metrics.timer(_stages, 'text_filter'):
+            mask = self._mask(texts, rows)
+
+        if language == 'eng':
+            with metrics.timer(_stages, 'encode'):
+                keys = [' '.join(query.split()) for query in queries]
+                uncached = [k for k in dict.fromkeys(keys) if k and ('eng', k) not in self.query_cache]
+                if uncached:
+                    self.query_cache.update(zip(
+                        [('eng', k) for k in uncached], self.eng_model.encode(uncached)
+                    ))
+                sents = [self.encode(query) if query != '' else None for query in queries]
+            repeats = [set([query]) for query in queries]
+
+        elif language == 'lat':
+            with metrics.timer(_stages, 'atomise'):
+                atoms = [self.atomise(query) if query != '' else [] for query in queries]
+            with metrics.timer(_stages, 'sense'):
+                sents = [self._sense(a, embedder) if a else None for a in atoms]
+            repeats = [set(a) for a in atoms]
+
+        valid = [i for i, sent in enumerate(sents) if sent is not None]
+        batch = [None for _ in queries]
+        if not valid:
+            return batch
+
+        # With an ANN index, each query only scores the lists it probes
+        if ann is not None and self.nprobe is not None:
+            for i in valid:
+                ranked = self._ranked(sents[i], vects, results, ann, mask)
+                batch[i] = self._collect(ranked, lemmata, rows, language, repeats[i], texts, results)
+            return batch
+
+        # As in `_ranked_rows`, filtered-out rows are scored and ranked last
+        with metrics.timer(_stages, 'similarity'):
+            sims = get_similarities(np.stack([sents[i] for i in valid]), vects).T
+            if mask is not None:
+                sims[:, ~mask] = -np.inf
+        block = TOPK_BLOCK_FACTOR * results
+        topk = metrics.stopwatch(_stages, 'topk')
+        for j, i in enumerate(valid):
+            indices = topk.iter(ranked_indices(sims[j], block))
+            if mask is not None:
+                indices = takewhile(mask.__getitem__, indices)
+            ranked = ((idx, sims[j, idx]) for idx in indices)
+            batch[i] = self._collect(ranked, lemmata, rows, language, repeats[i], texts, results)
+        topk.stop()
+
+        return batch
     
+    def result_key(self, query, language, texts=None, results=50, scope='universal'):
+        """The key of a search in the result cache, normalising the query as it will be."""
+        query = ' '.join(query.split()) if language == 'eng' else clean_query(query)
+        texts = tuple(sorted(set(self.all_docs if texts is None else texts)))
+        return (query, language, texts, results, scope, self.index_version)
+
+    def cached_result(self, key):
+        data = self.result_cache.get(key)
+        if data is None and self.result_store is not None:
+            data = self.result_store.get(key)
+            if data is not None:
+                self.result_cache.put(key, data)
+        return data
+
+    def cache_result(self, key, data):
+        if data is None:
+            return
+        self.result_cache.put(key, data)
+        if self.result_store is not None:
+            self.result_store.put(key, data)
+
+    def search_batch(
+        self,
+        queries: List[str],
+        language: Union["eng", "lat"],
+        texts: list = None,
+        results: int = 50,
+        scope: Union["universal", "root", str] = "universal"
+    ) -> List[Dict]:
+        """`_search_batch`, answering whatever it can from the result cache."""
+        keys = [self.result_key(query, language, texts, results, scope) for query in queries]
+        batch = [self.cached_result(key) for key in keys]
+
+        missing = [i for i, data in enumerate(batch) if data is None]
+        if missing:
+            found = self._search_batch([queries[i] for i in missing], language, texts, results, scope)
+            for i, data in zip(missing, found):
+                self.cache_result(keys[i], data)
+                batch[i] = data
+        return batch
+
+    def cache_stats(self):
+        return {
+            'scope': self.scope_cache.stats(),
+            'query': self.query_cache.stats(),
+            'result': self.result_cache.stats()
+        }
+
+    def persist_caches(self):
+        if self.query_cache_fpath is not None:
+            os.makedirs(Path(self.query_cache_fpath).parent, exist_ok=True)
+            try:
+                pickle_dump(self.query_cache.items(), Path(self.query_cache_fpath))
+            except OSError as e:
+                # Another worker may be persisting the same file
+                warnings.warn(f'Could not persist the query cache ({e}).')
+
     @clock_title('Aventine search engine query')
-    def search(self, *args, **kwargs):
+    def search(
+        self,
+        query: str,
+        language: Union["eng", "lat"],
+        texts: list = None,
+        results: int = 50,
+        scope: Union["universal", "root", str] = "universal"
+    ) -> Dict:
         try:
-            return self._search(*args, **kwargs)
+            key = self.result_key(query, language, texts, results, scope)
+            data = self.cached_result(key)
+            if data is None:
+                data = self._search(query, language, texts, results, scope)
+                self.cache_result(key, data)
+            return data
         except:
             return None
+
+
+# Every live engine, for the process-wide hooks below; held weakly so that
+# they do not keep discarded engines alive
+_engines = weakref.WeakSet()
+
+def _persist_caches():
+    for engine in list(_engines):
+        engine.persist_caches()
+
+def _after_fork():
+    # Under `gunicorn --preload` the engine is built once and forked into
+    # every worker, which then only needs its own locks and threads
+    for engine in list(_engines):
+        engine.after_fork()
+
+    if 'torch' in sys.modules:
+        threads = WORKER_TORCH_THREADS
+        if threads is None:
+            workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+            threads = max(1, (os.cpu_count() or 1) // workers)
+        sys.modules['torch'].set_num_threads(threads)
+
+atexit.register(_persist_caches)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -3,10 +3,15 @@ import re
 import json
 import time
 import random
+import functools
+import shutil
+import hashlib
+import threading
 import subprocess
 import numpy as np
 import pickle as pkl
 from pathlib import Path
+from collections import OrderedDict
 import unicodedata
 
 
@@ -38,13 +43,15 @@ def clock(func):
     return decor
 
 def clock_title(name):
+    """Records the duration of every call in the `aventine_process_seconds` histogram, as `name`."""
+    # `params` depends on this module, and `metrics` on `params`
+    from aventine.library import metrics
+    hist = metrics.histogram('aventine_process_seconds', 'Duration of timed processes.', label='process')
     def wrapper(func):
+        @functools.wraps(func)
         def decor(*args, **kwargs):
-            start = time.time()
-            ret = func(*args, **kwargs)
-            end = time.time()
-            _clock_analysis(start, end, name=name)
-            return ret
+            with metrics.timer(hist, name):
+                return func(*args, **kwargs)
         return decor
     return wrapper
 
@@ -117,6 +124,157 @@ def meanings(word, tool_dir):
     return parse_www_output(out, word)
 
 
+_missing = object()
+
+class LRUCache():
+    """
+    A thread-safe, size-bounded mapping that evicts its least recently used
+    entry, counting hits, misses and evictions as it goes.
+    """
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_create(self, key, create):
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = create()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def after_fork(self):
+        # The lock may have been held by another thread at the time of fork
+        self._lock = threading.Lock()
+
+    def items(self):
+        with self._lock:
+            return list(self._data.items())
+
+    def update(self, items):
+        for key, value in items:
+            self.put(key, value)
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+class FileCache():
+    """
+    A directory of pickles shared between processes, one per key, under a
+    `namespace` (e.g. an index version). Other namespaces are purged when it
+    is opened, and unreadable or half-written entries count as misses. Given
+    a `maxsize`, the least recently used entries (by mtime, which `get`
+    refreshes) are evicted every so often to bring it back to that many.
+    """
+    def __init__(self, cache_dir: Path, namespace: str, maxsize: int = None):
+        self.root = Path(cache_dir)
+        self.dir = self.root / namespace
+        self.maxsize = maxsize
+        self._puts = 0
+        os.makedirs(self.dir, exist_ok=True)
+        for name in os.listdir(self.root):
+            if name != namespace:
+                shutil.rmtree(self.root / name, ignore_errors=True)
+        self.evict()
+
+    def _fpath(self, key) -> Path:
+        return self.dir / f'{hashlib.sha1(repr(key).encode("utf-8")).hexdigest()}.pkl'
+
+    def get(self, key, default=None):
+        fpath = self._fpath(key)
+        try:
+            with open(fpath, 'rb') as f:
+                value = pkl.load(f)
+        except Exception:
+            return default
+        try:
+            os.utime(fpath)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        fpath = self._fpath(key)
+        _tmp_fpath = fpath.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            with open(_tmp_fpath, 'wb') as f:
+                pkl.dump(value, f)
+            os.replace(_tmp_fpath, fpath)
+        except OSError:
+            try:
+                os.remove(_tmp_fpath)
+            except OSError:
+                pass
+
+        # Listing the directory costs a pass over it, so it is only done once
+        # every tenth of `maxsize` writes
+        self._puts += 1
+        if self.maxsize is not None and self._puts >= max(self.maxsize // 10, 1):
+            self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries beyond `maxsize`."""
+        self._puts = 0
+        if self.maxsize is None:
+            return
+        entries = []
+        try:
+            with os.scandir(self.dir) as it:
+                for entry in it:
+                    if entry.name.endswith('.pkl'):
+                        try:
+                            entries.append((entry.stat().st_mtime, entry.path))
+                        except OSError:
+                            pass
+        except OSError:
+            return
+        if len(entries) <= self.maxsize:
+            return
+        entries.sort()
+        for _, fpath in entries[:len(entries) - self.maxsize]:
+            try:
+                os.remove(fpath)
+            except OSError:
+                pass
+
+
 class Bundler():
     def __init__(self):
         pass
@@ -163,6 +321,11 @@ def text_dump(obj, fpath: Path):
     with open(fpath, 'w', encoding='utf-8') as f:
         f.write(obj)
 
+@safely
+def npy_dump(obj, fpath: Path):
+    with open(fpath, 'wb') as f:
+        np.save(f, obj)
+
 @carefully
 def pickle_load(fpath):
     with open(fpath, 'rb') as f:
@@ -178,6 +341,10 @@ def text_load(fpath: Path):
     with open(fpath, 'r', encoding='utf-8') as f:
         return f.read()
 
+@carefully
+def npy_mmap(fpath: Path):
+    return np.load(fpath, mmap_mode='r')
+
 
 class Checkpointer():
     save_formats: dict = {
@@ -221,9 +388,11 @@ class Checkpointer():
             if overwrite or not os.path.exists(fpath):
                 save_func(obj, fpath)
 
-    def load(self, overwrite=False):
+    def load(self, overwrite=False, skip=()):
         bundle = Bundler()
         for prop in self.fingerprint:
+            if prop in skip:
+                continue
             _t = self.fingerprint[prop] if self.fingerprint[prop] in self.load_formats else None
             load_func, file_ext = self.load_formats[_t]
             fpath = self.save_dir / f'{prop}.{file_ext}'
@@ -243,6 +412,12 @@ def get_null(lat_model, eng_model):
         eng_model.encode('')
     )
 
+def unit_rows(vects):
+    vects = np.asarray(vects, dtype=np.float32)
+    norms = np.linalg.norm(vects, axis=1)
+    unit = vects / np.where(norms == 0, 1, norms)[:, np.newaxis]
+    return unit, norms
+
 def replace_if_none(val, alt):
     if val is None:
         return alt
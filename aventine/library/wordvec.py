@@ -1,9 +1,42 @@
 import os
+import json
+import numpy as np
+from array import array
+from pathlib import Path
 from typing import Union
 
 from gensim.models import Word2Vec
 
 from aventine.library.params import WORD2VEC_EPOCHS, WORD2VEC_DIMS
+from aventine.library.params import WORD2VEC_UPDATE_SAMPLE
+from aventine.library.utils import npy_dump, npy_mmap
+
+
+def stripped_lines(fpath):
+    """
+    Streams the lines of `text.strip().split('\n')` for the text in `fpath`,
+    holding back whitespace-only lines until it is clear they are not at the
+    end of the file.
+    """
+    with open(fpath, 'r', encoding='utf-8') as f:
+        last, blanks, started = None, [], False
+        for line in f:
+            line = line[:-1] if line.endswith('\n') else line
+            if not started:
+                line = line.lstrip()
+                if line == '':
+                    continue
+                started = True
+
+            if line.strip() == '':
+                blanks.append(line)
+                continue
+            if last is not None:
+                yield last
+                yield from blanks
+            last, blanks = line, []
+
+    yield '' if last is None else last.rstrip()
 
 
 class Corpus:
@@ -11,39 +44,155 @@ class Corpus:
         self.path = path
 
     def __iter__(self):
-        with open(self.path, 'r', encoding='utf-8') as f:
-            text = f.read().strip()
-        for line in text.split('\n'):
+        for line in stripped_lines(self.path):
             yield line.split(' ')
 
 
 class MultiCorpus:
-    def __init__(self, parent_dir):
+    def __init__(self, parent_dir, exclude=()):
         self.parent_dir = parent_dir
+        self.exclude = set(exclude)
 
     def __iter__(self):
         for text_id in os.listdir(self.parent_dir):
-            if text_id != 'root':
+            if text_id != 'root' and text_id not in self.exclude:
                 fpath = os.path.join(self.parent_dir, text_id, 'lemmatised.txt')
-                with open(fpath, 'r', encoding='utf-8') as f:
-                    text = f.read().strip()
-                for line in text.split('\n'):
+                for line in stripped_lines(fpath):
                     yield line.split(' ')
 
 
+class ChainedCorpus:
+    def __init__(self, *corpora):
+        self.corpora = corpora
+
+    def __iter__(self):
+        for corpus in self.corpora:
+            yield from corpus
+
+
+class SampledCorpus:
+    """The same random `fraction` of the sentences of `corpus` on every pass."""
+    def __init__(self, corpus, fraction, seed=0):
+        self.corpus = corpus
+        self.fraction = fraction
+        self.seed = seed
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed)
+        for sentence in self.corpus:
+            if rng.random() < self.fraction:
+                yield sentence
+
+
+class BinaryCorpus:
+    """
+    A corpus pre-tokenised into integer ids: `vocab.json` lists the tokens,
+    `ids.npy` holds every sentence end to end and `offsets.npy` where each
+    one starts. Iterating reads the memory-mapped ids front to back.
+    """
+    files = ('vocab.json', 'ids.npy', 'offsets.npy')
+
+    def __init__(self, save_dir):
+        self.save_dir = Path(save_dir)
+
+    @classmethod
+    def write(cls, corpus, save_dir):
+        """Tokenises `corpus` (any iterable of sentences) once into `save_dir`."""
+        save_dir = Path(save_dir)
+        os.makedirs(save_dir, exist_ok=True)
+
+        vocab, ids, offsets = {}, array('i'), array('q', [0])
+        for sentence in corpus:
+            ids.extend(vocab.setdefault(token, len(vocab)) for token in sentence)
+            offsets.append(len(ids))
+
+        npy_dump(np.frombuffer(ids, dtype=np.int32), save_dir / 'ids.npy')
+        npy_dump(np.frombuffer(offsets, dtype=np.int64), save_dir / 'offsets.npy')
+        with open(save_dir / 'vocab.json', 'w', encoding='utf-8') as f:
+            json.dump(list(vocab), f)
+        return cls(save_dir)
+
+    def __iter__(self):
+        with open(self.save_dir / 'vocab.json', 'r', encoding='utf-8') as f:
+            vocab = json.load(f)
+        ids = npy_mmap(self.save_dir / 'ids.npy')
+        offsets = npy_mmap(self.save_dir / 'offsets.npy')
+
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield [vocab[i] for i in ids[start:end].tolist()]
+
+
 def train_word2vec_model(
-        corpus: Union[str, Corpus, MultiCorpus],
+        corpus: Union[str, Corpus, MultiCorpus, BinaryCorpus],
         window: int = 5,
         min_count: int = 1,
         workers: int = 4,
         vector_size: int = WORD2VEC_DIMS,
-        epochs: int = WORD2VEC_EPOCHS
+        epochs: int = WORD2VEC_EPOCHS,
+        seed: int = 1
     ):
     model = Word2Vec(sentences=corpus,
                      vector_size=vector_size,
                      window=window,
                      min_count=min_count,
-                     workers=workers)
+                     workers=workers,
+                     seed=seed)
     model.train(corpus, total_examples=model.corpus_count, epochs=epochs)
 
     return model
+
+
+def update_word2vec_model(
+        model: Word2Vec,
+        new_corpus: Union[Corpus, MultiCorpus],
+        old_corpus: Union[Corpus, MultiCorpus] = None,
+        sample: float = WORD2VEC_UPDATE_SAMPLE,
+        epochs: int = WORD2VEC_EPOCHS,
+        seed: int = 0
+    ):
+    """
+    Continues training `model` on `new_corpus` after growing its vocabulary
+    from it, mixing in a `sample` fraction of the sentences of `old_corpus`
+    so that existing vectors are not pulled too far towards the new texts.
+    """
+    model.build_vocab(new_corpus, update=True)
+
+    corpus = new_corpus
+    if old_corpus is not None and sample > 0:
+        corpus = ChainedCorpus(new_corpus, SampledCorpus(old_corpus, sample, seed=seed))
+    model.train(corpus, total_examples=sum(1 for _ in corpus), epochs=epochs)
+
+    return model
+
+
+def compare_models(
+        a: Word2Vec,
+        b: Word2Vec,
+        k: int = 10,
+        num_words: int = 1000,
+        seed: int = 0
+    ) -> dict:
+    """
+    How closely the vectors of `a` agree with those of `b`, as the mean
+    overlap of the `k` nearest neighbours of a fixed random sample of their
+    shared vocabulary, and the correlation of the similarities of its pairs.
+    """
+    shared = sorted(set(a.wv.index_to_key).intersection(b.wv.index_to_key))
+    rng = np.random.default_rng(seed)
+    words = [shared[i] for i in rng.choice(len(shared), size=min(num_words, len(shared)), replace=False)]
+
+    overlap = np.mean([
+        len({w for w, _ in a.wv.most_similar(word, topn=k)}.intersection(
+            w for w, _ in b.wv.most_similar(word, topn=k)
+        )) / k
+        for word in words
+    ])
+    pairs = rng.choice(len(words), size=(min(num_words, len(words)), 2))
+    sims_a = [a.wv.similarity(words[i], words[j]) for i, j in pairs]
+    sims_b = [b.wv.similarity(words[i], words[j]) for i, j in pairs]
+
+    return {
+        'words': len(words),
+        f'overlap@{k}': float(overlap),
+        'similarity_correlation': float(np.corrcoef(sims_a, sims_b)[0, 1])
+    }
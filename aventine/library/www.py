@@ -0,0 +1,248 @@
+import os
+import re
+import json
+import queue
+import shutil
+import warnings
+import threading
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from aventine.library.params import WWW_WORKERS, WWW_TIMEOUT, WWW_CACHE_FPATH
+from aventine.library.utils import parse_www_output
+
+
+_prompt = re.compile(r'=>\s*$')
+_more = re.compile(r'MORE[^\n]*$')
+
+
+def www_binary(tool_dir: Path) -> str:
+    """Path to the `meanings` binary in `tool_dir`, or else on the PATH."""
+    for name in ('meanings', 'meanings.exe'):
+        fpath = Path(tool_dir) / name
+        if os.path.isfile(fpath):
+            return str(fpath.resolve())
+
+    binary = shutil.which('meanings')
+    if binary is None:
+        raise FileNotFoundError(f"Whitaker's Words (`meanings`) is neither in {tool_dir} nor on the PATH.")
+    return binary
+
+
+class DefinitionCache():
+    """
+    Whitaker's Words output by token, kept in memory and appended to a JSON
+    lines file so that no token is ever looked up twice. A torn last line
+    from an interrupted run is ignored, and the next entry starts a new line.
+    """
+    def __init__(self, fpath: Path = None):
+        self.fpath = None if fpath is None else Path(fpath)
+        self._data = {}
+        self._lock = threading.Lock()
+        self._torn = False
+
+        if self.fpath is not None and os.path.exists(self.fpath):
+            with open(self.fpath, 'r', encoding='utf-8') as f:
+                for line in f:
+                    self._torn = not line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._data[entry['word']] = entry['meaning']
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, word):
+        return word in self._data
+
+    def __getitem__(self, word):
+        return self._data[word]
+
+    def update(self, entries):
+        entries = [(word, meaning) for word, meaning in entries if word not in self._data]
+        with self._lock:
+            self._data.update(entries)
+            if self.fpath is None or not entries:
+                return
+            os.makedirs(self.fpath.parent, exist_ok=True)
+            with open(self.fpath, 'a', encoding='utf-8') as f:
+                if self._torn:
+                    f.write('\n')
+                    self._torn = False
+                for word, meaning in entries:
+                    f.write(json.dumps({'word': word, 'meaning': meaning}) + '\n')
+
+
+class WordsProcess():
+    """
+    One long-lived, interactive Whitaker's Words process. Each word is
+    written to its stdin and the answer is read back up to the next input
+    prompt, with any MORE prompts along the way answered with a newline.
+    """
+    def __init__(self,
+                 binary: str,
+                 tool_dir: Path,
+                 timeout: float = WWW_TIMEOUT):
+        self.timeout = timeout
+        self.process = subprocess.Popen([binary],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL,
+                                        cwd=tool_dir)
+        self._output = queue.Queue()
+        threading.Thread(target=self._read, daemon=True).start()
+        try:
+            self._response()    # banner, up to the first prompt
+        except BaseException:
+            self._kill()
+            raise
+
+    def _read(self):
+        fd = self.process.stdout.fileno()
+        while data := os.read(fd, 65536):
+            self._output.put(data)
+        self._output.put(b'')
+        self.process.stdout.close()
+
+    def _send(self, line: str):
+        self.process.stdin.write((line + os.linesep).encode('utf-8'))
+        self.process.stdin.flush()
+
+    def _response(self) -> str:
+        pages, buffer = [], b''
+        while True:
+            try:
+                data = self._output.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError(f"Whitaker's Words did not answer within {self.timeout}s.")
+            if not data:
+                raise EOFError("Whitaker's Words exited unexpectedly.")
+
+            buffer += data
+            text = buffer.decode('utf-8', errors='replace').replace('\r', '')
+            if _prompt.search(text):
+                pages.append(_prompt.sub('', text))
+                return ''.join(pages)
+            if _more.search(text):
+                pages.append(_more.sub('', text))
+                buffer = b''
+                self._send('')
+
+    def ask(self, word: str) -> str:
+        # A blank line would end the session
+        if not word.strip():
+            return ''
+        self._send(word.split()[0])
+        out = self._response().strip()
+        out = re.sub(r'[\r\*]', '', out)
+        return parse_www_output(out, word)
+
+    def _kill(self):
+        self.process.kill()
+        self.process.wait()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+
+    def close(self):
+        try:
+            self._send('')
+            self.process.stdin.close()
+            self.process.wait(timeout=self.timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            self._kill()
+
+
+class WordsPool():
+    """
+    A pool of up to `size` `WordsProcess`es behind a `DefinitionCache`,
+    started on demand and looked up in parallel.
+    """
+    def __init__(self,
+                 tool_dir: Path,
+                 size: int = WWW_WORKERS,
+                 cache_fpath: Path = WWW_CACHE_FPATH,
+                 timeout: float = WWW_TIMEOUT):
+        self.tool_dir = tool_dir
+        self.binary = www_binary(tool_dir)
+        self.size = size
+        self.timeout = timeout
+        self.cache = DefinitionCache(cache_fpath)
+        self._idle = queue.LifoQueue()
+        self._started = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _acquire(self) -> WordsProcess:
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                start = self._started < self.size
+                if start:
+                    self._started += 1
+            if start:
+                break
+            # A busy process may be discarded rather than returned, which
+            # frees a slot to start a new one in, so waits are bounded
+            try:
+                return self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                continue
+        try:
+            return WordsProcess(self.binary, self.tool_dir, self.timeout)
+        except BaseException:
+            with self._lock:
+                self._started -= 1
+            raise
+
+    def _discard(self, process: WordsProcess):
+        process.close()
+        with self._lock:
+            self._started -= 1
+
+    def _ask(self, word: str, retries: int = 1) -> str:
+        process = self._acquire()
+        try:
+            meaning = process.ask(word)
+        except (TimeoutError, EOFError, OSError) as e:
+            self._discard(process)
+            if retries <= 0:
+                raise
+            warnings.warn(f'Restarting Whitaker\'s Words after looking up `{word}`: {e}')
+            return self._ask(word, retries - 1)
+        self._idle.put(process)
+        return meaning
+
+    def meanings(self, words: list[str]) -> list[str]:
+        """The Whitaker's Words meaning of each of `words`, in order."""
+        missing = list(dict.fromkeys(w for w in words if w not in self.cache))
+        if len(missing) > 1 and self.size > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.size)
+            self.cache.update(zip(missing, self._executor.map(self._ask, missing)))
+        elif missing:
+            self.cache.update((word, self._ask(word)) for word in missing)
+        return [self.cache[w] for w in words]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
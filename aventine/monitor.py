@@ -0,0 +1,42 @@
+import re
+import time
+from flask import (
+    Blueprint, g, request, Response
+)
+from aventine.library import metrics
+from aventine.library.params import METRICS, SERVER_TIMING
+
+bp = Blueprint('monitor', __name__)
+
+_requests = metrics.histogram('aventine_request_seconds',
+                              'Time taken to answer each request, by endpoint.', label='endpoint')
+
+
+def server_timing(timings, total):
+    """A `Server-Timing` header value, in milliseconds, with the stage names made into tokens."""
+    entries = [f'{re.sub(r"[^A-Za-z0-9_.-]+", "_", name)};dur={seconds * 1000:.2f}'
+               for name, seconds in timings.items()]
+    entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
+
+
+@bp.before_app_request
+def start_timing():
+    if METRICS:
+        g.request_start = time.perf_counter()
+        if SERVER_TIMING:
+            metrics.start_request()
+
+@bp.after_app_request
+def finish_timing(response):
+    if METRICS and 'request_start' in g:
+        total = time.perf_counter() - g.request_start
+        metrics.observe(_requests, total, request.endpoint or 'unknown')
+        if SERVER_TIMING:
+            response.headers['Server-Timing'] = server_timing(metrics.end_request(), total)
+    return response
+
+
+@bp.route('/metrics')
+def export():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -2,6 +2,8 @@ from flask import (
     Blueprint, flash, g, redirect, render_template, request, session, url_for
 )
 from aventine.library.engines import default_engine as engine
+from aventine.library.engines import default_scheduler as scheduler
+from aventine.library.params import CITATIONS_PAGE_SIZE
 
 bp = Blueprint('search', __name__, url_prefix='/search')
 
@@ -16,10 +18,10 @@ def search():
             texts = {i.strip() for i in request.args.get('texts').split(',')}
         results = int(n) if (n := request.args.get('results')) is not None else 50
 
-        data = engine.search(query=query,
-                            language=language,
-                            texts=texts,
-                            results=results)
+        data = scheduler.search(query=query,
+                                language=language,
+                                texts=texts,
+                                results=results)
         g.query = query
         g.language = language
         g.texts = ', '.join([id for id in texts]) if texts is not None else 'ALL'
@@ -35,4 +37,26 @@ def search():
 
     except:
         return 'O TEMPORA! O MORES!\nSomething has gone terribly wrong.'
-    
\ No newline at end of file
+
+
+@bp.route('/citations')
+def citations():
+    try:
+        lemma = request.args.get('lemma').strip()
+        text_id = request.args.get('text').strip()
+        offset = int(n) if (n := request.args.get('offset')) is not None else 0
+        limit = CITATIONS_PAGE_SIZE
+
+        g.query = lemma
+        g.language = 'lat'
+        g.texts = text_id
+        g.titles = engine.id2title[text_id]
+        g.total = engine.num_citations(lemma, text_id)
+        g.citations = engine.citations(lemma, text_id, offset=offset, limit=limit)
+        g.offset = offset
+        g.limit = limit
+
+        return render_template('citations.html')
+
+    except:
+        return 'O TEMPORA! O MORES!\nSomething has gone terribly wrong.'
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from aventine.library.ann import build_ann_indices, load_ann_indices
+from aventine.library.matrices import matrix_path, read_matrix, write_matrix
+from aventine.library.params import ROOT_MATRICES
+from aventine.benchmarks.synthetic import synthetic_index
+
+
+@pytest.fixture
+def root_dir(tmp_path):
+    synthetic_index(tmp_path / 'sources', tmp_path / 'index', num_lemmata=500, num_texts=2,
+                    chunks_per_text=50, lat_dims=8, eng_dims=16)
+    return tmp_path / 'index' / 'root'
+
+
+def test_loads_fresh_indices(root_dir):
+    build_ann_indices(root_dir, verbose=False)
+    assert set(load_ann_indices(root_dir, 500)) == set(ROOT_MATRICES)
+
+
+def test_reordered_rows_make_an_index_stale(root_dir):
+    build_ann_indices(root_dir, verbose=False)
+    # As after a rebuild that unindexes and re-indexes a text: same rows, new order
+    name = ROOT_MATRICES[0]
+    unit = np.array(read_matrix(matrix_path(root_dir, name)))
+    write_matrix(unit[::-1], matrix_path(root_dir, name))
+
+    with pytest.warns(UserWarning, match='stale'):
+        indices = load_ann_indices(root_dir, 500)
+    assert name not in indices
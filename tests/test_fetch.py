@@ -0,0 +1,80 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from aventine.library.fetch import CachedSession, pooled_session
+
+
+BODY = b'<TEI.2><text><body><p>arma virumque cano</p></body></text></TEI.2>'
+ETAG = '"v1"'
+
+
+class StubPerseus(BaseHTTPRequestHandler):
+    """Serves `BODY` with an ETag, and a 304 to a request that already has it."""
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.send_header('ETag', ETAG)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StubPerseus.requests = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubPerseus)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def session(cache_dir):
+    return CachedSession(pooled_session(pool_size=1, retries=0), cache_dir=cache_dir, timeout=5)
+
+
+def test_revalidates_with_etag(server, tmp_path):
+    url = f'{server}/text/1999.02.0055.xml'
+
+    first = session(tmp_path).get(url)
+    assert first.status_code == 200 and first.content == BODY
+
+    # A new session, as on the next run, answers the 304 from disk
+    second = session(tmp_path).get(url)
+    assert second.status_code == 200 and second.content == BODY
+    assert StubPerseus.requests == [('/text/1999.02.0055.xml', None), ('/text/1999.02.0055.xml', ETAG)]
+
+
+@pytest.mark.parametrize('leftover', ['.body.tmp', '.tmp'])
+def test_recovers_from_interrupted_write(server, tmp_path, leftover):
+    url = f'{server}/text/1999.02.0059.xml'
+    cached = session(tmp_path)
+    cached.get(url)
+
+    # As left by a run killed while writing the body or the headers
+    body_fpath, headers_fpath = cached._paths(url)
+    stem = body_fpath if leftover == '.body.tmp' else headers_fpath
+    with open(stem.with_suffix(leftover), 'wb') as f:
+        f.write(BODY[:10])
+
+    response = session(tmp_path).get(url)
+    assert response.status_code == 200 and response.content == BODY
+    assert not os.path.exists(stem.with_suffix(leftover))
+
+    # The entry is rebuilt, and revalidated from then on
+    assert session(tmp_path).get(url).content == BODY
+    assert StubPerseus.requests[-1] == ('/text/1999.02.0059.xml', ETAG)
@@ -0,0 +1,29 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from aventine.library.files import linear_parse
+
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+
+# perseus.golden.json holds what the BeautifulSoup parser that `linear_parse`
+# replaced made of perseus.xml: `linear_parse(soup.find('body'))`, and
+# `soup.find(name).text` for each header element
+with open(FIXTURES / 'perseus.golden.json', encoding='utf-8') as f:
+    GOLDEN = json.load(f)
+
+
+@pytest.mark.parametrize('read_size', [2**20, 7, 1])
+def test_matches_beautifulsoup(read_size):
+    collated, index, header = linear_parse(FIXTURES / 'perseus.xml', read_size=read_size)
+    assert collated == GOLDEN['collated']
+    assert index == GOLDEN['index']
+    assert header == GOLDEN['header']
+
+
+def test_header_reports_the_outermost_element():
+    # The nested <title> closes first, but the outer one opens first
+    _, _, header = linear_parse(FIXTURES / 'perseus.xml')
+    assert header['title'].strip() == 'De Bello Gallico commentarii'
@@ -0,0 +1,87 @@
+import pytest
+
+from aventine.library.index import analyse, analyse_batch
+
+
+class Word():
+    def __init__(self, string, lemma, upos):
+        self.string = string
+        self.lemma = lemma
+        self.upos = upos
+        # As with cltk's StanzaProcess, which never sets it
+        self.index_char_start = None
+
+
+class Doc():
+    def __init__(self, words, normalized_text=None):
+        self.words = words
+        self.normalized_text = normalized_text
+
+    @property
+    def lemmata(self):
+        return [w.lemma for w in self.words]
+
+    @property
+    def tokens(self):
+        return [w.string for w in self.words]
+
+    @property
+    def pos(self):
+        return [w.upos for w in self.words]
+
+
+class StubNLP():
+    """
+    Splits off punctuation and lemmatises by dropping a final `-que`,
+    normalising `j` to `i` first (as cltk's LatinNormalizeProcess does), and
+    counts the words it analyses.
+    """
+    def __init__(self):
+        self.analysed = 0
+
+    def analyze(self, text):
+        normalized = text.replace('j', 'i')
+        words = []
+        for token in normalized.replace(',', ' , ').replace('.', ' . ').split():
+            if token in {',', '.'}:
+                words.append(Word(token, token, 'PUNCT'))
+            else:
+                words.append(Word(token, token.removesuffix('que'), 'NOUN'))
+        self.analysed += len(words)
+        return Doc(words, normalized)
+
+
+TEXTS = [
+    'arma virumque cano , troiae qui primus ab oris',
+    'italiam fato profugus , laviniaque venit',
+    'litora , multum ille et terris iactatus et alto .',
+    'vi superum saevae memorem iunonis ob iram',
+    'jam',
+]
+
+
+def test_batch_matches_one_call_per_chunk():
+    per_chunk = [analyse(StubNLP(), text) for text in TEXTS]
+    nlp = StubNLP()
+    assert analyse_batch(nlp, TEXTS) == per_chunk
+    # Each word was analysed once, so the batch did not fall back
+    assert nlp.analysed == sum(len(StubNLP().analyze(text).words) for text in TEXTS)
+
+
+@pytest.mark.parametrize('texts', [TEXTS[:2], ['arma', 'arma', 'arma'], [TEXTS[0]]])
+def test_batch_of_repeated_or_few_chunks(texts):
+    assert analyse_batch(StubNLP(), texts) == [analyse(StubNLP(), text) for text in texts]
+
+
+def test_falls_back_when_words_cannot_be_aligned():
+    class Rewriting(StubNLP):
+        def analyze(self, text):
+            doc = super().analyze(text)
+            for word in doc.words:
+                word.string = word.string.upper()
+            return doc
+
+    nlp = Rewriting()
+    words = analyse_batch(nlp, TEXTS[:2])
+    assert words == [analyse(Rewriting(), text) for text in TEXTS[:2]]
+    assert nlp.analysed > sum(len(StubNLP().analyze(text).words) for text in TEXTS[:2])
@@ -0,0 +1,24 @@
+import os
+
+from aventine.library.utils import FileCache
+
+
+def test_file_cache_evicts_least_recently_used(tmp_path):
+    cache = FileCache(tmp_path, 'v1', maxsize=10)
+    for i in range(10):
+        cache.put(i, i)
+        os.utime(cache._fpath(i), (i, i))
+    # Reading an entry makes it the most recently used
+    assert cache.get(0) == 0
+
+    cache.put(10, 10)
+    assert len(os.listdir(cache.dir)) == 10
+    assert cache.get(1) is None
+    assert [cache.get(i) for i in (0, *range(2, 11))] == [0, *range(2, 11)]
+
+
+def test_file_cache_purges_other_namespaces(tmp_path):
+    FileCache(tmp_path, 'v1').put('key', 'old')
+    cache = FileCache(tmp_path, 'v2')
+    assert os.listdir(tmp_path) == ['v2']
+    assert cache.get('key') is None
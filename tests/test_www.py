@@ -0,0 +1,95 @@
+import os
+import json
+import queue
+import shutil
+import threading
+from pathlib import Path
+
+import pytest
+
+from aventine.library.utils import parse_www_output
+from aventine.library.www import DefinitionCache, WordsProcess, WordsPool
+
+
+STUB = Path(__file__).parent / 'fixtures' / 'www' / 'meanings'
+
+pytestmark = pytest.mark.skipif(os.name == 'nt', reason='the stub `meanings` is a Python script')
+
+AMO = parse_www_output('am.o                 V      1 1 PRES ACTIVE  IND 1 S\n'
+                       'amo, amare, amavi, amatus  V (1st)   [XXXAO]\n'
+                       'love, like; fall in love with; be fond of;', 'amo')
+
+
+@pytest.fixture
+def tool_dir(tmp_path):
+    shutil.copy(STUB, tmp_path / 'meanings')
+    return tmp_path
+
+
+def test_reads_up_to_the_prompt(tool_dir):
+    process = WordsProcess(str(tool_dir / 'meanings'), tool_dir, timeout=5)
+    try:
+        assert process.ask('amo') == AMO
+        assert process.ask('amo') == AMO
+        assert process.ask('xyzzy') == ''
+    finally:
+        process.close()
+    assert process.process.poll() is not None
+
+
+def test_answers_more_prompts(tool_dir):
+    process = WordsProcess(str(tool_dir / 'meanings'), tool_dir, timeout=5)
+    try:
+        meaning = process.ask('multa')
+        # Both pages, without the MORE prompt between them
+        assert 'much, many, great, large;' in meaning
+        assert 'abundant; frequent; long (time); tedious;' in meaning
+        assert 'MORE' not in meaning
+        assert process.ask('amo') == AMO
+    finally:
+        process.close()
+
+
+@pytest.mark.parametrize('word, timeout', [('flaky', 5), ('slow', 1)])
+def test_pool_restarts_after_eof_or_timeout(tool_dir, word, timeout):
+    with WordsPool(tool_dir, size=1, cache_fpath=None, timeout=timeout) as pool:
+        with pytest.warns(UserWarning, match='Restarting'):
+            meaning, amo = pool.meanings([word, 'amo'])
+        assert meaning.startswith('answered')
+        assert amo == AMO
+        assert pool._started == 1
+
+
+def test_pool_frees_the_slot_of_a_process_that_cannot_start(tool_dir):
+    (tool_dir / 'meanings').write_text('#!/bin/sh\nexit 1\n')
+    with WordsPool(tool_dir, size=1, cache_fpath=None, timeout=5) as pool:
+        with pytest.raises(EOFError):
+            pool.meanings(['amo'])
+        assert pool._started == 0
+
+
+def test_acquire_starts_a_process_once_a_busy_one_is_discarded(tool_dir):
+    with WordsPool(tool_dir, size=1, cache_fpath=None, timeout=0.2) as pool:
+        busy = pool._acquire()
+        acquired = queue.Queue()
+        waiter = threading.Thread(target=lambda: acquired.put(pool._acquire()), daemon=True)
+        waiter.start()
+        pool._discard(busy)
+        process = acquired.get(timeout=10)
+        assert process is not busy and process.ask('amo') == AMO
+        pool._idle.put(process)
+
+
+def test_definition_cache_recovers_from_a_torn_line(tmp_path):
+    fpath = tmp_path / 'definitions.jsonl'
+    with open(fpath, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'word': 'amo', 'meaning': 'love'}) + '\n')
+        f.write('{"word": "multa", "mea')
+
+    cache = DefinitionCache(fpath)
+    assert len(cache) == 1 and cache['amo'] == 'love'
+
+    cache.update([('multa', 'many'), ('amo', 'ignored')])
+    reloaded = DefinitionCache(fpath)
+    assert len(reloaded) == 2
+    assert reloaded['multa'] == 'many' and reloaded['amo'] == 'love'